@@ -0,0 +1,32 @@
+# Batch sizer that steers the number of rows per batch toward a target latency and payload
+# size. After every batch it works out how many rows would have hit each target at the
+# observed per-row time and per-row bytes, takes the smaller of the two, and moves part of the
+# way there (growing at most 2x per batch so one fast batch can't overshoot). A timeout halves
+# the size straight away.
+class AdaptiveBatchSizer:
+    def __init__(self, initial_size=500, min_size=50, max_size=50000, target_latency=2.0, target_bytes=4 * 1024 * 1024, smoothing=0.5):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.target_bytes = target_bytes
+        self.smoothing = smoothing
+        self.batch_size = self.clamp(initial_size)
+
+    def clamp(self, size):
+        return max(self.min_size, min(self.max_size, int(size)))
+
+    # Function to update the batch size from a finished batch
+    def record(self, rows, batch_time, batch_bytes):
+        if rows <= 0:
+            return
+        desired = self.max_size
+        if batch_time > 0:
+            desired = min(desired, rows * self.target_latency / batch_time)
+        if batch_bytes > 0:
+            desired = min(desired, rows * self.target_bytes / batch_bytes)
+        desired = min(desired, self.batch_size * 2)
+        self.batch_size = self.clamp(self.batch_size + (desired - self.batch_size) * self.smoothing)
+
+    # Function to shrink the batch size after a batch timed out
+    def record_timeout(self):
+        self.batch_size = self.clamp(self.batch_size // 2)
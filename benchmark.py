@@ -0,0 +1,277 @@
+import os
+import sys
+import csv
+import gzip
+import json
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+from csv_chunks import read_header
+from engines import ENGINES, create_connection, db_config_from_env
+
+# Words used to build synthetic review text
+WORDS = ['seat', 'cover', 'car', 'fits', 'perfectly', 'great', 'quality', 'leather', 'easy', 'install', 'color', 'matches',
+         'interior', 'would', 'recommend', 'price', 'material', 'thin', 'waterproof', 'dog', 'kids', 'truck', 'sun',
+         'faded', 'after', 'months', 'straps', 'snug', 'loose', 'customer', 'service', 'returned', 'love', 'it', 'the',
+         'and', 'but', 'not', 'very', 'café', 'déjà', 'naïve']
+
+# Fixed columns of the synthetic review file; wider files get extra_N columns after these
+BASE_COLUMNS = ['review_id', 'product_id', 'rating', 'title', 'review_text', 'reviewer_name', 'review_date', 'verified_purchase']
+
+# Function to build a piece of review text that exercises CSV quoting: commas, quotes,
+# embedded newlines and ISO-8859-1 characters
+def review_text(rng, words):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    if rng.random() < 0.3:
+        text = text.replace(' but ', ', but ', 1)
+    if rng.random() < 0.1:
+        text = f'"{text}" - {rng.choice(WORDS)}'
+    if rng.random() < 0.1:
+        text = text.replace(' and ', '\nand ', 1)
+    return text
+
+# Function to generate a synthetic review CSV with the given number of rows and columns.
+# About 5% of the optional values are left empty so NULL conversion is exercised too.
+def generate_csv(csv_file_path, rows, columns=len(BASE_COLUMNS), text_words=60, seed=0):
+    rng = random.Random(seed)
+    header = BASE_COLUMNS[:columns] + [f'extra_{i}' for i in range(columns - len(BASE_COLUMNS))]
+    with open(csv_file_path, 'w', encoding='ISO-8859-1', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for i in range(rows):
+            row = [
+                str(i + 1),
+                f'P{rng.randrange(10000):05d}',
+                str(rng.randint(1, 5)),
+                review_text(rng, rng.randint(2, 8)),
+                review_text(rng, rng.randint(text_words // 2, text_words * 3 // 2)) if rng.random() > 0.05 else '',
+                f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}',
+                f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+                rng.choice(['true', 'false', '']),
+            ]
+            row = row[:columns] + [rng.choice(WORDS) if rng.random() > 0.05 else '' for _ in range(columns - len(BASE_COLUMNS))]
+            writer.writerow(row)
+    return header
+
+# Function to (re)create the benchmark table with one text column per CSV column
+def reset_table(db_config, table_name, header):
+    conn = create_connection(db_config)
+    try:
+        cur = conn.cursor()
+        cur.execute(f"DROP TABLE IF EXISTS {table_name}")
+        column_definitions = [f'"{col}" text' for col in header]
+        cur.execute(f"CREATE TABLE {table_name} ({', '.join(column_definitions)})")
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+# Minimal local stand-in for the PostgREST insert endpoint the Supabase client talks to.
+# It accepts POST /rest/v1/<table> with a JSON array body over keep-alive HTTP/1.1 and answers
+# 201. By default the rows are only parsed, which measures the client side on its own; with a
+# db_config they are inserted into the local Postgres with execute_values, like PostgREST would.
+class PostgrestStandIn:
+    def __init__(self, db_config=None, port=0):
+        local = threading.local()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # The headers and body go out in separate writes; with Nagle's algorithm the body
+            # would wait for the client's delayed ACK, adding ~40ms to every request
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                table_name = self.path.split('?')[0].rsplit('/', 1)[-1]
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                rows = json.loads(body)
+                if db_config is not None and rows:
+                    from psycopg2.extras import execute_values
+                    if getattr(local, 'conn', None) is None:
+                        local.conn = create_connection(db_config)
+                    columns = list(rows[0])
+                    escaped_columns = [f'"{col}"' for col in columns]
+                    cur = local.conn.cursor()
+                    execute_values(cur, f"INSERT INTO {table_name} ({', '.join(escaped_columns)}) VALUES %s",
+                                   [tuple(row.get(col) for col in columns) for row in rows], page_size=len(rows))
+                    local.conn.commit()
+                    cur.close()
+                body = b'[]'
+                self.send_response(201)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+# Function to run one benchmark case in this process and write its metrics to result_path.
+# This is what the child processes started by run_case execute.
+def run_case_in_process(spec, result_path):
+    from upload import upload_csv
+    from parallel_copy import upload_csv_using_parallel_copy
+
+    if spec['engine'] == 'parallel_copy':
+        from metrics import UploadMetrics
+        metrics = UploadMetrics()
+        if not upload_csv_using_parallel_copy(spec['csv'], spec['table'], parallel=spec['concurrency']):
+            raise RuntimeError("Parallel COPY failed")
+        metrics.finish()
+        metrics.rows = spec['rows']
+    else:
+        columns = read_header(spec['csv'])
+        if spec['engine'] == 'supabase':
+            engine = ENGINES['supabase'](spec['table'], columns, spec['supabase_url'], spec['supabase_key'])
+        else:
+            engine = ENGINES[spec['engine']](spec['table'], columns)
+        try:
+            metrics = upload_csv(engine, spec['csv'], spec['table'], batch_size=spec['batch_size'], concurrency=spec['concurrency'],
+                                 retry_delay=1)
+        finally:
+            engine.close()
+
+    with open(result_path, 'w') as f:
+        json.dump({
+            'rows': metrics.rows,
+            'elapsed': metrics.elapsed(),
+            'rows_per_second': metrics.rows / metrics.elapsed() if metrics.elapsed() > 0 else 0,
+            'p50_ms': metrics.latency_percentile(50) * 1000,
+            'p99_ms': metrics.latency_percentile(99) * 1000,
+            'retries': metrics.retries,
+        }, f)
+
+# Function to run one benchmark case in a fresh child process, so that its peak RSS can be
+# read from the child's own resource usage
+def run_case(spec):
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+        result_path = f.name
+    try:
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'run-case', '--spec', json.dumps(spec), '--result', result_path],
+                                stdout=subprocess.DEVNULL)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode != 0:
+            raise RuntimeError(f"Benchmark case {spec['engine']} failed with exit code {proc.returncode}")
+        with open(result_path, 'r') as f:
+            result = json.load(f)
+    finally:
+        os.remove(result_path)
+    result['peak_rss_mb'] = rusage.ru_maxrss / 1024  # ru_maxrss is in kilobytes on Linux
+    return {**spec, **result}
+
+# Function to format one result line of the report
+def format_result(result):
+    batch_size = result['batch_size'] if result['engine'] != 'parallel_copy' else '-'
+    return (f"{result['engine']:<15} {batch_size:>6} {result['concurrency']:>5} {result['rows_per_second']:>12.0f} "
+            f"{result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['peak_rss_mb']:>9.1f}")
+
+# Function to run the whole sweep: every engine at every batch size and concurrency level
+def run_benchmark(args):
+    db_config = db_config_from_env()
+    csv_file_path = args.csv
+    if csv_file_path is None:
+        csv_file_path = os.path.join(tempfile.gettempdir(), f"bench_reviews_{args.rows}x{args.columns}.csv")
+        if not os.path.exists(csv_file_path):
+            print(f"Generating {args.rows} rows x {args.columns} columns into {csv_file_path}")
+            generate_csv(csv_file_path, args.rows, args.columns, args.text_words)
+    header = read_header(csv_file_path)
+    with open(csv_file_path, 'r', encoding='ISO-8859-1', newline='') as f:
+        rows = sum(1 for _ in csv.reader(f)) - 1
+
+    standin = None
+    supabase_url, supabase_key = args.supabase_url, args.supabase_key
+    engines = args.engines.split(',')
+    if 'supabase' in engines and supabase_url is None:
+        standin = PostgrestStandIn(db_config if args.standin_db else None).start()
+        supabase_url, supabase_key = standin.url, 'bench.bench.bench'
+
+    print(f"{'engine':<15} {'batch':>6} {'conc':>5} {'rows/sec':>12} {'p50 ms':>9} {'p99 ms':>9} {'RSS MB':>9}")
+    results = []
+    try:
+        for engine in engines:
+            batch_sizes = [None] if engine == 'parallel_copy' else [int(size) for size in args.batch_sizes.split(',')]
+            for batch_size in batch_sizes:
+                for concurrency in [int(level) for level in args.concurrency.split(',')]:
+                    if engine != 'supabase' or args.standin_db or args.supabase_url:
+                        reset_table(db_config, args.table, header)
+                    spec = {'engine': engine, 'csv': csv_file_path, 'table': args.table, 'rows': rows, 'batch_size': batch_size,
+                            'concurrency': concurrency, 'supabase_url': supabase_url, 'supabase_key': supabase_key}
+                    result = run_case(spec)
+                    results.append(result)
+                    print(format_result(result))
+    finally:
+        if standin is not None:
+            standin.stop()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+    return results
+
+# Function to parse the command line
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the loader engines against a local Postgres and PostgREST stand-in')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = subparsers.add_parser('generate', help='Write a synthetic review CSV')
+    generate_parser.add_argument('--out', type=str, required=True, help='Path of the CSV file to write')
+    generate_parser.add_argument('--rows', type=int, default=100000, help='Number of data rows')
+    generate_parser.add_argument('--columns', type=int, default=len(BASE_COLUMNS), help='Number of columns')
+    generate_parser.add_argument('--text-words', type=int, default=60, help='Average number of words per review text')
+
+    run_parser = subparsers.add_parser('run', help='Run the engine / batch size / concurrency sweep')
+    run_parser.add_argument('--csv', type=str, help='CSV file to load (default: generate one with --rows/--columns)')
+    run_parser.add_argument('--rows', type=int, default=100000, help='Rows to generate when no --csv is given')
+    run_parser.add_argument('--columns', type=int, default=len(BASE_COLUMNS), help='Columns to generate when no --csv is given')
+    run_parser.add_argument('--text-words', type=int, default=60, help='Average number of words per generated review text')
+    run_parser.add_argument('--table', type=str, default='bench_reviews', help='Scratch table to load into (dropped and recreated for every case)')
+    run_parser.add_argument('--engines', type=str, default='execute_batch,execute_values,copy,parallel_copy,supabase',
+                            help='Comma-separated engines to run (parallel_copy is the whole-file COPY split over --concurrency connections)')
+    run_parser.add_argument('--batch-sizes', type=str, default='500,5000', help='Comma-separated batch sizes to sweep')
+    run_parser.add_argument('--concurrency', type=str, default='1,4', help='Comma-separated concurrency levels to sweep')
+    run_parser.add_argument('--supabase-url', type=str, help='Use this Supabase/PostgREST URL instead of the built-in stand-in')
+    run_parser.add_argument('--supabase-key', type=str, help='API key for --supabase-url')
+    run_parser.add_argument('--standin-db', action='store_true', help='Make the stand-in insert the rows into the local Postgres')
+    run_parser.add_argument('--output', type=str, help='Also write the results as JSON lines to this file')
+
+    run_case_parser = subparsers.add_parser('run-case', help=argparse.SUPPRESS)
+    run_case_parser.add_argument('--spec', type=str, required=True)
+    run_case_parser.add_argument('--result', type=str, required=True)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Load environment variables from .env file
+    load_dotenv()
+
+    if args.command == 'generate':
+        generate_csv(args.out, args.rows, args.columns, args.text_words)
+    elif args.command == 'run':
+        run_benchmark(args)
+    else:
+        run_case_in_process(json.loads(args.spec), args.result)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
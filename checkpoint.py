@@ -0,0 +1,169 @@
+import csv
+import json
+import os
+import re
+import time
+import hashlib
+import logging
+from input_files import is_compressed
+from row_offsets import RowOffsetIndex
+
+# Function to build the default checkpoint file path for a table, or for one of several CSV
+# files loaded into it. The file's name is kept readable, and a short hash of its absolute path
+# tells apart files of the same name in different directories.
+def default_checkpoint_path(table_name, csv_file_path=None):
+    if csv_file_path is None:
+        return f"{table_name}_upload_checkpoint.json"
+    file_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', os.path.basename(csv_file_path))
+    path_hash = hashlib.sha1(os.path.abspath(csv_file_path).encode('utf-8')).hexdigest()[:8]
+    return f"{table_name}_{file_name}_{path_hash}_upload_checkpoint.json"
+
+# Line iterator over a file opened in binary mode that decodes each line and keeps
+# track of the byte offset of everything handed out so far. csv.reader only pulls as
+# many lines as it needs for one record (quoted newlines included), so after every
+# row it yields, `offset` is the byte position of the start of the next record.
+# `read_time` adds up the seconds spent reading and decoding lines. When `lines` is set to a
+# list, the decoded lines are also appended to it, so the raw text of a record can be kept.
+class OffsetLineReader:
+    def __init__(self, f, encoding='ISO-8859-1'):
+        self.f = f
+        self.encoding = encoding
+        self.offset = f.tell()
+        self.read_time = 0.0
+        self.lines = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        line = self.f.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        line = line.decode(self.encoding)
+        if self.lines is not None:
+            self.lines.append(line)
+        self.read_time += time.perf_counter() - start
+        return line
+
+    # Jump straight to a byte offset previously recorded from `offset`
+    def seek(self, offset):
+        self.f.seek(offset)
+        self.offset = offset
+
+# Function to create a fresh checkpoint for a CSV file and table.
+# `byte_offset`/`row` mark the in-order prefix of the file that is committed. Batches are
+# stored as [start_row, end_row, end_offset] and cover rows start_row+1 .. end_row:
+# `completed` holds batches committed ahead of the prefix by concurrent uploads, and
+# `pending` holds batches sent but not yet known to be committed, with their PostgreSQL
+# transaction id (or None) as a fourth item.
+def new_checkpoint(csv_file_path, table_name, byte_offset, row):
+    return {
+        'csv_file': os.path.abspath(csv_file_path),
+        'table': table_name,
+        'byte_offset': byte_offset,
+        'row': row,
+        'completed': [],
+        'pending': [],
+    }
+
+# Function to load a checkpoint, making sure it belongs to the same CSV file and table
+def load_checkpoint(checkpoint_path, csv_file_path, table_name):
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, 'r') as f:
+        checkpoint = json.load(f)
+    if checkpoint['csv_file'] != os.path.abspath(csv_file_path) or checkpoint['table'] != table_name:
+        raise ValueError(f"Checkpoint {checkpoint_path} was written for {checkpoint['csv_file']} -> {checkpoint['table']}, not {csv_file_path} -> {table_name}")
+    return checkpoint
+
+# Function to write a checkpoint durably: write a temp file, fsync it and atomically
+# rename it over the old one so a crash never leaves a half-written checkpoint behind
+def save_checkpoint(checkpoint_path, checkpoint):
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+# Function to record a batch that is about to be committed. For PostgreSQL the
+# transaction id is stored so a later run can tell whether the commit went through.
+def mark_pending(checkpoint_path, checkpoint, start_row, end_row, end_offset, txid=None):
+    checkpoint['pending'] = [p for p in checkpoint['pending'] if p[0] != start_row]
+    checkpoint['pending'].append([start_row, end_row, end_offset, txid])
+    save_checkpoint(checkpoint_path, checkpoint)
+
+# Function to record a committed batch. The prefix advances over it (and over any batches
+# committed ahead of it that it now touches); otherwise it is kept in `completed`.
+def mark_committed(checkpoint_path, checkpoint, start_row, end_row, end_offset):
+    checkpoint['pending'] = [p for p in checkpoint['pending'] if p[0] != start_row]
+    checkpoint['completed'].append([start_row, end_row, end_offset])
+    checkpoint['completed'].sort()
+    for start, end, offset in checkpoint['completed']:
+        if start <= checkpoint['row'] < end:
+            checkpoint['row'] = end
+            checkpoint['byte_offset'] = offset
+    checkpoint['completed'] = [c for c in checkpoint['completed'] if c[1] > checkpoint['row']]
+    save_checkpoint(checkpoint_path, checkpoint)
+
+# Function to settle the batches a crashed run left pending. transaction_committed is called
+# with each recorded transaction id; batches without one cannot be checked and are resent.
+def resolve_pending_checkpoint(checkpoint_path, checkpoint, transaction_committed):
+    pending, checkpoint['pending'] = checkpoint['pending'], []
+    for start_row, end_row, end_offset, txid in pending:
+        if txid is not None and transaction_committed is not None and transaction_committed(txid):
+            mark_committed(checkpoint_path, checkpoint, start_row, end_row, end_offset)
+    save_checkpoint(checkpoint_path, checkpoint)
+
+# Function to check whether a row was already committed ahead of the checkpoint by a
+# concurrent run that stopped before the rows in front of it were committed. `committed_ahead`
+# is the copy of the checkpoint's completed batches taken when the upload started: the live
+# list is pruned as the prefix advances, while the rows it covered are still ahead of the reader.
+def row_already_committed(committed_ahead, row_number):
+    return any(start < row_number <= end for start, end, _ in committed_ahead)
+
+# Function to open a CSV reader positioned at the first row to upload. On resume it seeks
+# straight to the checkpointed byte offset; otherwise it skips start_row rows (looking the row
+# up in the file's row offset index, or reading past the rows of a compressed or streamed
+# input) and, if a checkpoint path is given, starts a new checkpoint there. transaction_committed is used to
+# settle batches that were pending when the previous run stopped. Also returns a copy of the
+# batches committed ahead of the starting point, which the reader has to skip.
+def open_reader_at_start(f, csv_file_path, table_name, start_row=0, checkpoint_path=None, resume=False, transaction_committed=None):
+    line_reader = OffsetLineReader(f)
+    reader = csv.reader(line_reader)
+    header = next(reader)  # Skip the header row
+
+    checkpoint = None
+    if resume:
+        checkpoint = load_checkpoint(checkpoint_path, csv_file_path, table_name)
+        if checkpoint is None:
+            logging.info(f"No checkpoint found at {checkpoint_path}, starting from row {start_row}")
+            print(f"No checkpoint found at {checkpoint_path}, starting from row {start_row}")
+
+    start_skip_time = time.time()
+    if checkpoint is not None:
+        resolve_pending_checkpoint(checkpoint_path, checkpoint, transaction_committed)
+        line_reader.seek(checkpoint['byte_offset'])
+        total_rows = checkpoint['row']
+        skip_duration = time.time() - start_skip_time
+        logging.info(f"Resumed at row {total_rows} (byte offset {checkpoint['byte_offset']}) in {skip_duration:.2f} seconds")
+        print(f"Resumed at row {total_rows} (byte offset {checkpoint['byte_offset']}) in {skip_duration:.2f} seconds")
+    else:
+        if start_row and not is_compressed(csv_file_path):
+            with RowOffsetIndex(csv_file_path) as index:
+                line_reader.seek(index.offset_of_row(start_row))
+        else:
+            for _ in range(start_row):
+                next(reader, None)
+        total_rows = start_row
+        if checkpoint_path:
+            checkpoint = new_checkpoint(csv_file_path, table_name, line_reader.offset, start_row)
+            save_checkpoint(checkpoint_path, checkpoint)
+        skip_duration = time.time() - start_skip_time
+        logging.info(f"Skipped {start_row} rows in {skip_duration:.2f} seconds")
+        print(f"Skipped {start_row} rows in {skip_duration:.2f} seconds")
+
+    committed_ahead = [list(batch) for batch in checkpoint['completed']] if checkpoint is not None else []
+    return line_reader, reader, header, total_rows, checkpoint, committed_ahead
@@ -0,0 +1,92 @@
+import time
+import threading
+
+# Pool of database connections shared by the insert workers. Connections are opened on
+# demand up to max_size and get() blocks while all of them are in use. A connection that has
+# sat idle for longer than health_check_interval seconds is pinged with SELECT 1 before it is
+# handed out, so one the server or a proxy dropped is replaced instead of failing a batch.
+# on_connect runs once on every new connection (e.g. to prepare statements).
+class ConnectionPool:
+    def __init__(self, connect, max_size=1, health_check_interval=30, on_connect=None):
+        self.connect = connect
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self.on_connect = on_connect
+        self.idle = []
+        self.size = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    # Function to check an idle connection before reusing it
+    def is_healthy(self, conn, last_used):
+        if conn.closed != 0:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT 1")
+            finally:
+                cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    # Function to take a connection from the pool, opening a new one if needed
+    def get(self):
+        conn = None
+        with self.condition:
+            while not self.idle and self.size >= self.max_size:
+                self.condition.wait()
+            if self.idle:
+                conn, last_used = self.idle.pop()
+            else:
+                self.size += 1
+
+        if conn is not None:
+            if self.is_healthy(conn, last_used):
+                return conn
+            close_quietly(conn)
+
+        # The slot of a dropped connection is reused for its replacement
+        conn = None
+        try:
+            conn = self.connect()
+            if self.on_connect is not None:
+                self.on_connect(conn)
+            return conn
+        except Exception:
+            # A connection whose setup failed is closed, not left open until it is collected
+            if conn is not None:
+                close_quietly(conn)
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+
+    # Function to give a connection back; broken ones are closed and make room for a new one
+    def put(self, conn, discard=False):
+        with self.condition:
+            if discard or self.closed or conn.closed != 0:
+                self.size -= 1
+                close_quietly(conn)
+            else:
+                self.idle.append((conn, time.monotonic()))
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            for conn, _ in self.idle:
+                close_quietly(conn)
+            self.size -= len(self.idle)
+            self.idle = []
+
+# Function to close a connection that may already be dead
+def close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
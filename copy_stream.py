@@ -0,0 +1,96 @@
+import csv
+from datetime import datetime
+from itertools import islice
+from operator import itemgetter
+
+# Characters that have to be escaped in COPY text format
+COPY_TEXT_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+# Function to turn "CSV Column=target_column" and dropped column arguments into a column map
+def parse_column_map(mappings=None, dropped=None):
+    column_map = {}
+    for mapping in mappings or []:
+        source, _, target = mapping.partition('=')
+        column_map[source] = target
+    for column in dropped or []:
+        column_map[column] = None
+    return column_map
+
+# Function to work out the target columns for a CSV header and a function that picks the
+# matching values out of a row. The selector is None when every column is kept as-is.
+def column_selector(header, column_map=None):
+    column_map = column_map or {}
+    indices = []
+    columns = []
+    for i, name in enumerate(header):
+        target = column_map.get(name, name)
+        if target is not None:
+            indices.append(i)
+            columns.append(target)
+    if len(indices) == len(header):
+        return columns, None
+    if len(indices) == 1:
+        return columns, itemgetter(slice(indices[0], indices[0] + 1))
+    return columns, itemgetter(*indices)
+
+# Function to write a value that isn't a non-empty string as COPY text: blanks and None are
+# NULL (\N), and the typed values of schema.TypedRowConverter get their canonical text form
+def copy_text_value(value):
+    if value is None or value == '':
+        return '\\N'
+    if value is True or value is False:
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+# Function to encode rows as COPY text format: empty strings become NULL (\N) and
+# backslashes, tabs and newlines inside values are escaped
+def encode_copy_rows(rows):
+    lines = ['\t'.join([value.translate(COPY_TEXT_ESCAPES) if value.__class__ is str and value else copy_text_value(value)
+                        for value in row]) for row in rows]
+    lines.append('')
+    return '\n'.join(lines).encode('utf-8')
+
+# Function to build a COPY statement for the transformed stream
+def build_copy_sql(table_name, columns):
+    escaped_columns = [f'"{col}"' for col in columns]
+    return f"COPY {table_name} ({', '.join(escaped_columns)}) FROM STDIN WITH (FORMAT text, ENCODING 'UTF8')"
+
+# File-like object that streams CSV rows to cursor.copy_expert as COPY text format, applying
+# the same transforms as the INSERT loaders on the way: empty strings become NULL (\N), the
+# ISO-8859-1 input is re-encoded as UTF-8, and columns are renamed or dropped following
+# column_map ({csv_header: target_column, or None to drop it}). Rows are converted
+# rows_per_chunk at a time with C-level helpers (itemgetter, str.translate, join) and only
+# one chunk is buffered, so memory stays flat however large the file is.
+class TransformingCopyStream:
+    def __init__(self, lines, header, column_map=None, rows_per_chunk=1000):
+        self.columns, self.select = column_selector(header, column_map)
+        self.reader = csv.reader(lines)
+        self.rows_per_chunk = rows_per_chunk
+        self.buffer = b''
+        self.pos = 0
+        self.rows = 0
+
+    # Function to convert the next chunk of CSV rows into COPY text bytes
+    def _next_chunk(self):
+        rows = list(islice(self.reader, self.rows_per_chunk))
+        if not rows:
+            return b''
+        self.rows += len(rows)
+        if self.select is not None:
+            rows = map(self.select, rows)
+        return encode_copy_rows(rows)
+
+    # Reads hand out at most one converted chunk at a time, which copy_expert handles fine
+    # since it keeps reading until it gets an empty result
+    def read(self, size=-1):
+        if size < 0:
+            data = self.buffer[self.pos:] + b''.join(iter(self._next_chunk, b''))
+            self.buffer, self.pos = b'', 0
+            return data
+        if self.pos >= len(self.buffer):
+            self.buffer, self.pos = self._next_chunk(), 0
+        data = self.buffer[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
@@ -0,0 +1,39 @@
+import csv
+from checkpoint import OffsetLineReader
+from input_files import open_input
+
+# Function to read the header row of a CSV file (compressed or stdin too, see input_files)
+def read_header(csv_file_path):
+    with open_input(csv_file_path, peek=True) as f:
+        return next(csv.reader(OffsetLineReader(f)))
+
+# Function to read a CSV file from a record boundary in blocks of about block_size bytes
+# that each end on a record boundary, yielding (offset, data) pairs. Each block is cut after
+# the last newline that is outside quotes, found by walking back from the end of the block
+# with bytes.rfind/bytes.count, and the remainder is carried into the next block.
+def read_record_blocks(f, start, block_size=4 * 1024 * 1024):
+    f.seek(start)
+    offset = start
+    carry = b''
+    while True:
+        chunk = f.read(block_size)
+        if not chunk:
+            if carry:
+                yield offset, carry
+            return
+        data = carry + chunk
+        quotes = data.count(b'"')
+        cut = 0
+        end = len(data)
+        newline = data.rfind(b'\n', 0, end)
+        while newline != -1:
+            quotes -= data.count(b'"', newline, end)
+            if not quotes & 1:
+                cut = newline + 1
+                break
+            end = newline
+            newline = data.rfind(b'\n', 0, end)
+        if cut:
+            yield offset, data[:cut]
+            offset += cut
+        carry = data[cut:]
@@ -0,0 +1,75 @@
+import io
+import os
+import csv
+import json
+import logging
+import threading
+from input_files import open_input
+
+# Function to build the default dead-letter file path for a table
+def default_dead_letter_path(table_name):
+    return f"{table_name}_dead_letters.jsonl"
+
+# JSON lines file of rows that could not be loaded, one object per row with the CSV file and
+# its header, the file row number, the byte range and raw text of the CSV record, and the
+# error. Records are read back from the CSV file by byte range, unless the caller passes the
+# record's text (it does for compressed files, which would otherwise be decompressed again up
+# to every bad row), or looked up in `records` (row number -> text) when rows are being replayed. The file is only created once a row
+# fails (a fresh upload removes the one from the previous run, a resumed one appends to it),
+# and every row is flushed to disk as soon as it is written, so the file is complete even if
+# the load dies.
+class DeadLetterQueue:
+    def __init__(self, path, csv_file_path, header, append=False, records=None):
+        self.path = path
+        self.csv_file_path = csv_file_path
+        self.header = header
+        self.records = records
+        self.count = 0
+        self.lock = threading.Lock()
+        self.file = None
+        if not append and os.path.exists(path):
+            os.remove(path)
+
+    # Function to read the raw CSV record of a row
+    def record(self, row_number, start_offset, end_offset):
+        if self.records is not None:
+            return self.records[row_number]
+        with open_input(self.csv_file_path) as f:
+            f.seek(start_offset)
+            return f.read(end_offset - start_offset).decode('ISO-8859-1')
+
+    def add(self, row_number, start_offset, end_offset, error, record=None):
+        entry = {
+            'csv_file': os.path.abspath(self.csv_file_path),
+            'header': self.header,
+            'row': row_number,
+            'offset': start_offset,
+            'end_offset': end_offset,
+            'record': record if record is not None else self.record(row_number, start_offset, end_offset),
+            'error': str(error),
+        }
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'a', encoding='utf-8')
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.count += 1
+        logging.error(f"Row {row_number} written to {self.path}: {error}")
+        print(f"Row {row_number} written to {self.path}: {error}")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+# Function to read a dead-letter file back as a list of entries, each with its record parsed
+# into a list of CSV values under 'values'
+def load_dead_letters(path):
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entry['values'] = next(csv.reader(io.StringIO(entry['record'], newline='')))
+                entries.append(entry)
+    return entries
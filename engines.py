@@ -0,0 +1,437 @@
+import io
+import os
+import gzip
+import time
+from copy_stream import encode_copy_rows, build_copy_sql
+from rate_limit import parse_retry_after
+from connection_pool import ConnectionPool
+from row_batch import RowBatch
+from json_body import encode_json_rows, split_json_rows
+
+# Functions that turn raw CSV rows into an engine's payload. They take the target columns and
+# are module-level so that batches can also be encoded in worker processes.
+def raw_rows(columns, rows):
+    return rows
+
+def rows_to_batch(columns, rows):
+    return RowBatch.from_rows(columns, rows)
+
+def rows_to_copy_text(columns, rows):
+    return encode_copy_rows(rows)
+
+# Function to build the ON CONFLICT clause of an INSERT: with an upsert key, rows that
+# conflict on the key are updated with the new values; otherwise they are skipped when
+# on_conflict_do_nothing is set
+def conflict_clause(columns, on_conflict_do_nothing=False, upsert_key=None):
+    if upsert_key:
+        target = ', '.join(f'"{col}"' for col in upsert_key)
+        updates = ', '.join(f'"{col}" = EXCLUDED."{col}"' for col in columns if col not in upsert_key)
+        return f" ON CONFLICT ({target}) DO UPDATE SET {updates}" if updates else f" ON CONFLICT ({target}) DO NOTHING"
+    return " ON CONFLICT DO NOTHING" if on_conflict_do_nothing else ""
+
+# Function to read the PostgreSQL connection details from environment variables
+def db_config_from_env():
+    return {
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT'),
+        'dbname': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD')
+    }
+
+# Function to establish a new connection to the database
+def create_connection(db_config):
+    import psycopg2
+    return psycopg2.connect(
+        host=db_config['host'],
+        port=db_config['port'],
+        dbname=db_config['dbname'],
+        user=db_config['user'],
+        password=db_config['password']
+    )
+
+# Base class for loader engines. The upload core reads and batches the CSV, then hands each
+# batch to an engine in two steps: prepare() turns raw CSV rows (lists of strings, already
+# column-mapped) into the engine's payload with encode_rows, on the reader thread or in a
+# parsing worker process, and insert() sends and
+# commits that payload, possibly from a worker thread. start() is called with the number of
+# workers before the first batch. Errors that is_retryable() accepts (by default those in
+# retryable_errors) are retried after reset(); errors that is_row_error() accepts are caused by
+# some of the rows in the batch, and anything else (a missing table or column, no permission)
+# fails the batch.
+class Engine:
+    name = None
+    default_batch_size = 500
+    retryable_errors = ()
+    encode_rows = staticmethod(raw_rows)
+    # Set by the upload to a function(stage, seconds) that collects per-stage timings
+    stage_timer = None
+
+    def __init__(self, table_name, columns):
+        self.table_name = table_name
+        self.columns = columns
+
+    # Called before the upload with the number of batches that will be in flight at once
+    def start(self, workers):
+        pass
+
+    def prepare(self, rows):
+        return self.encode_rows(self.columns, rows)
+
+    # before_commit, if given, is called with the transaction id just before committing
+    def insert(self, batch, before_commit=None):
+        raise NotImplementedError
+
+    # Called after a retryable error so the next attempt starts from a fresh connection
+    def reset(self):
+        pass
+
+    def is_retryable(self, error):
+        return isinstance(error, self.retryable_errors)
+
+    # Returns whether an error is caused by some of the rows in the batch (a bad value, a
+    # constraint violation), so that the rows causing it can be isolated by splitting the batch
+    def is_row_error(self, error):
+        return False
+
+    def record_stage(self, stage, seconds):
+        if self.stage_timer is not None:
+            self.stage_timer(stage, seconds)
+
+    # Returns roughly how many bytes the batch puts on the wire, given the size of the CSV
+    # text it was built from
+    def payload_size(self, batch, csv_bytes):
+        return csv_bytes
+
+    # Returns whether an error means the batch was too big or too slow for the server, in
+    # which case it is worth retrying as smaller batches. Engines decide this from the error's
+    # type or code, never its text: a connection that timed out is a retry, not a smaller batch.
+    def is_timeout(self, error):
+        return False
+
+    # Returns how many seconds the server asked us to wait when an error means we are being
+    # throttled (0 when it didn't say), or None when the error is not throttling
+    def retry_after(self, error):
+        return None
+
+    # Splits a prepared batch after its first `count` rows
+    def split_batch(self, batch, count):
+        return batch[:count], batch[count:]
+
+    # Returns whether a transaction id passed to before_commit was committed, or None when
+    # the engine cannot tell
+    def transaction_committed(self, txid):
+        return None
+
+    def close(self):
+        pass
+
+# Base class for the psycopg2 engines. Batches are sent over a pool of connections, one per
+# worker, so several batches are in flight at once, and every batch is committed in its own
+# transaction. A connection that fails with a connection error is dropped from the pool and the
+# retry gets a fresh one; connections that sat idle are health-checked before reuse.
+class PostgresEngine(Engine):
+    health_check_interval = 30
+
+    def __init__(self, table_name, columns, db_config=None):
+        super().__init__(table_name, columns)
+        import psycopg2
+        self.psycopg2 = psycopg2
+        self.retryable_errors = (psycopg2.OperationalError, psycopg2.InterfaceError)
+        self.db_config = db_config or db_config_from_env()
+        self.escaped_columns = ', '.join(f'"{col}"' for col in columns)
+        self.pool = None
+
+    def start(self, workers):
+        if self.pool is None:
+            self.pool = ConnectionPool(lambda: create_connection(self.db_config), max_size=workers,
+                                       health_check_interval=self.health_check_interval, on_connect=self.on_connect)
+
+    # Called once on every new connection before it is used
+    def on_connect(self, conn):
+        pass
+
+    # Function to borrow a pooled connection; the pool holds a single connection when the
+    # engine is used without start()
+    def get_connection(self):
+        if self.pool is None:
+            self.start(1)
+        return self.pool.get()
+
+    # Subclasses send the batch on the cursor; the commit is handled here
+    def write(self, cur, batch):
+        raise NotImplementedError
+
+    def insert(self, batch, before_commit=None):
+        conn = self.get_connection()
+        discard = False
+        try:
+            cur = conn.cursor()
+            try:
+                start = time.perf_counter()
+                self.write(cur, batch)
+                if before_commit is not None:
+                    cur.execute("SELECT txid_current()")
+                    before_commit(cur.fetchone()[0])
+                sent = time.perf_counter()
+                self.record_stage('network', sent - start)
+                conn.commit()
+                self.record_stage('commit', time.perf_counter() - sent)
+            finally:
+                cur.close()
+        except Exception as e:
+            discard = isinstance(e, self.retryable_errors) or conn.closed != 0
+            if not discard:
+                try:
+                    conn.rollback()
+                except self.psycopg2.Error:
+                    discard = True
+            raise
+        finally:
+            self.pool.put(conn, discard)
+
+    # A statement timeout cancels the query with SQLSTATE 57014
+    def is_timeout(self, error):
+        return isinstance(error, self.psycopg2.extensions.QueryCanceledError) or getattr(error, 'pgcode', None) == '57014'
+
+    # Data exceptions (SQLSTATE class 22) and integrity constraint violations (class 23)
+    def is_row_error(self, error):
+        if isinstance(error, (self.psycopg2.DataError, self.psycopg2.IntegrityError)):
+            return True
+        return (getattr(error, 'pgcode', None) or '')[:2] in ('22', '23')
+
+    def transaction_committed(self, txid):
+        conn = self.get_connection()
+        discard = False
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT txid_status(%s)", (txid,))
+                committed = cur.fetchone()[0] == 'committed'
+            finally:
+                cur.close()
+            conn.rollback()
+            return committed
+        except Exception:
+            discard = True
+            raise
+        finally:
+            self.pool.put(conn, discard)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+
+# Single-row INSERT statement sent with psycopg2.extras.execute_batch. The INSERT is prepared
+# server-side once per connection, so each page of the batch is a run of EXECUTEs that reuse
+# the same plan instead of INSERTs that are parsed and planned one by one. With
+# on_conflict_do_nothing, rows that hit a unique constraint are skipped instead of failing;
+# with an upsert key they update the existing row.
+class ExecuteBatchEngine(PostgresEngine):
+    name = 'execute_batch'
+    statement_name = 'upload_insert'
+    encode_rows = staticmethod(rows_to_batch)
+
+    def __init__(self, table_name, columns, db_config=None, on_conflict_do_nothing=False, upsert_key=None):
+        super().__init__(table_name, columns, db_config)
+        from psycopg2.extras import execute_batch
+        self.execute_batch = execute_batch
+        on_conflict = conflict_clause(columns, on_conflict_do_nothing, upsert_key)
+        self.prepare_sql = (f"PREPARE {self.statement_name} AS INSERT INTO {table_name} ({self.escaped_columns}) "
+                            f"VALUES ({', '.join(f'${i}' for i in range(1, len(columns) + 1))}){on_conflict}")
+        self.query = f"EXECUTE {self.statement_name} ({', '.join(['%s'] * len(columns))})"
+
+    def on_connect(self, conn):
+        cur = conn.cursor()
+        try:
+            cur.execute(self.prepare_sql)
+        finally:
+            cur.close()
+        conn.commit()
+
+    def write(self, cur, batch):
+        self.execute_batch(cur, self.query, batch.rows())
+
+# Multi-row INSERT ... VALUES statement sent with psycopg2.extras.execute_values: every
+# page_size rows of a batch go out as one statement, so a batch no bigger than page_size is a
+# single round trip. With on_conflict_do_nothing, rows that hit a unique constraint are skipped
+# so a re-run over rows that are already loaded doesn't fail; with an upsert key they update the
+# existing row.
+class ExecuteValuesEngine(PostgresEngine):
+    name = 'execute_values'
+    default_page_size = 1000
+    encode_rows = staticmethod(rows_to_batch)
+
+    def __init__(self, table_name, columns, db_config=None, page_size=None, on_conflict_do_nothing=False, upsert_key=None):
+        super().__init__(table_name, columns, db_config)
+        from psycopg2.extras import execute_values
+        self.execute_values = execute_values
+        self.page_size = page_size or self.default_page_size
+        on_conflict = conflict_clause(columns, on_conflict_do_nothing, upsert_key)
+        self.query = f"INSERT INTO {table_name} ({self.escaped_columns}) VALUES %s{on_conflict}"
+
+    def write(self, cur, batch):
+        self.execute_values(cur, self.query, batch.rows(), page_size=self.page_size)
+
+# One COPY ... FROM STDIN per batch, with the batch pre-encoded as COPY text on the reader
+# thread. COPY can't upsert, so with an upsert key each batch is copied into a temporary table
+# (one per connection, emptied on commit) and moved over with INSERT ... SELECT ... ON CONFLICT.
+class CopyEngine(PostgresEngine):
+    name = 'copy'
+    default_batch_size = 50000
+    encode_rows = staticmethod(rows_to_copy_text)
+    upsert_table = 'upload_upsert'
+
+    def __init__(self, table_name, columns, db_config=None, upsert_key=None):
+        super().__init__(table_name, columns, db_config)
+        self.upsert_sql = None
+        if upsert_key:
+            self.copy_sql = build_copy_sql(self.upsert_table, columns)
+            self.upsert_sql = (f"INSERT INTO {table_name} ({self.escaped_columns}) SELECT {self.escaped_columns} "
+                               f"FROM {self.upsert_table}{conflict_clause(columns, upsert_key=upsert_key)}")
+        else:
+            self.copy_sql = build_copy_sql(table_name, columns)
+
+    def on_connect(self, conn):
+        if self.upsert_sql is None:
+            return
+        cur = conn.cursor()
+        try:
+            cur.execute(f"CREATE TEMP TABLE {self.upsert_table} ON COMMIT DELETE ROWS AS "
+                        f"SELECT {self.escaped_columns} FROM {self.table_name} WITH NO DATA")
+        finally:
+            cur.close()
+        conn.commit()
+
+    def payload_size(self, batch, csv_bytes):
+        return len(batch)
+
+    # Every row is exactly one line of COPY text, since newlines inside values are escaped
+    def split_batch(self, batch, count):
+        lines = batch.split(b'\n', count)
+        return b'\n'.join(lines[:count]) + b'\n', lines[count]
+
+    def write(self, cur, batch):
+        cur.copy_expert(self.copy_sql, io.BytesIO(batch), size=1024 * 1024)
+        if self.upsert_sql is not None:
+            cur.execute(self.upsert_sql)
+
+# Error for a PostgREST request that came back with an HTTP error status
+class PostgrestHTTPError(Exception):
+    def __init__(self, response):
+        super().__init__(f"{response.status_code} {response.text[:1000]}")
+        self.code = response.status_code
+        self.response = response
+
+# Inserts through Supabase's PostgREST API. Batches are encoded straight into the JSON
+# request body when they are prepared and posted over one persistent httpx session, which
+# speaks HTTP/2 when the h2 package is installed (concurrent batches then share a single
+# connection) and keep-alive HTTP/1.1 otherwise. With gzip_body the body is gzip-compressed,
+# which needs a gateway in front of PostgREST that accepts Content-Encoding: gzip. Every
+# request is its own transaction, but there is no transaction id to check afterwards. With an
+# upsert key, rows that conflict on it are merged into the existing rows. Network
+# errors, timeouts, throttling and server errors are retried; a 400, 409 or 422 that carries a
+# data exception or constraint violation code is a problem with the rows, and any other HTTP
+# error status (a missing table, a bad key) fails the batch. Extra headers are sent with every
+# request. Prefer options are added to return=minimal, but can't replace the options the engine
+# sets itself. timeout/connect_timeout bound each request and each new connection. transport
+# replaces the httpx transport, e.g. with an httpx.MockTransport in tests.
+class SupabaseEngine(Engine):
+    name = 'supabase'
+    retryable_errors = (Exception,)
+    encode_rows = staticmethod(encode_json_rows)
+    gzip_level = 1
+    timeout = 60
+
+    def __init__(self, table_name, columns, supabase_url=None, supabase_key=None, gzip_body=False, upsert_key=None,
+                 timeout=None, connect_timeout=None, headers=None, transport=None):
+        super().__init__(table_name, columns)
+        import httpx
+        try:
+            import h2  # noqa: F401
+            http2 = True
+        except ImportError:
+            http2 = False
+        supabase_url = supabase_url or os.getenv('SUPABASE_URL')
+        supabase_key = supabase_key or os.getenv('SUPABASE_KEY')
+        self.gzip_body = gzip_body
+        self.params = {'on_conflict': ','.join(upsert_key)} if upsert_key else None
+        prefer = 'return=minimal,resolution=merge-duplicates' if upsert_key else 'return=minimal'
+        request_headers = {'apikey': supabase_key, 'Authorization': f"Bearer {supabase_key}",
+                           'Content-Type': 'application/json', 'Prefer': prefer}
+        for name, value in (headers or {}).items():
+            # Extra Prefer options are added to ours rather than replacing return=minimal
+            if name.lower() == 'prefer':
+                ours = {option.split('=')[0].strip() for option in prefer.split(',')}
+                clashing = [option.strip() for option in value.split(',') if option.split('=')[0].strip() in ours]
+                if clashing:
+                    raise ValueError(f"Prefer: {', '.join(clashing)} conflicts with the engine's Prefer: {prefer}")
+                request_headers['Prefer'] = f"{prefer},{value}"
+            else:
+                request_headers[name] = value
+        timeout = timeout or self.timeout
+        self.session = httpx.Client(base_url=f"{supabase_url.rstrip('/')}/rest/v1", http2=http2, headers=request_headers,
+                                    timeout=httpx.Timeout(timeout, connect=connect_timeout or timeout), transport=transport)
+
+    def is_retryable(self, error):
+        if isinstance(error, PostgrestHTTPError):
+            return error.code in (408, 429) or error.code >= 500
+        return True
+
+    # PostgREST passes the SQLSTATE of a failed insert on as the code in its JSON body
+    def is_row_error(self, error):
+        if not isinstance(error, PostgrestHTTPError) or error.code not in (400, 409, 422):
+            return False
+        try:
+            body = error.response.json()
+        except ValueError:
+            return False
+        return isinstance(body, dict) and str(body.get('code'))[:2] in ('22', '23')
+
+    def payload_size(self, batch, csv_bytes):
+        return len(batch)
+
+    def split_batch(self, batch, count):
+        return split_json_rows(batch, count)
+
+    # PostgREST reports a statement timeout with the error code 57014 in its JSON body, and an
+    # oversized body comes back as 413; a response that doesn't arrive in time counts too
+    def is_timeout(self, error):
+        import httpx
+        if isinstance(error, httpx.ReadTimeout):
+            return True
+        if not isinstance(error, PostgrestHTTPError):
+            return False
+        if error.code == 413:
+            return True
+        try:
+            body = error.response.json()
+        except ValueError:
+            return False
+        return isinstance(body, dict) and body.get('code') == '57014'
+
+    # A 429 or 503 from PostgREST or the API gateway in front of it, which comes with the
+    # response and its Retry-After header
+    def retry_after(self, error):
+        response = getattr(error, 'response', None)
+        status = getattr(response, 'status_code', None) or getattr(error, 'code', None)
+        if str(status) not in ('429', '503'):
+            return None
+        headers = getattr(response, 'headers', None) or {}
+        return parse_retry_after(headers.get('Retry-After')) or 0
+
+    def insert(self, batch, before_commit=None):
+        headers = None
+        if self.gzip_body:
+            batch = gzip.compress(batch, self.gzip_level)
+            headers = {'Content-Encoding': 'gzip'}
+        start = time.perf_counter()
+        response = self.session.post(f"/{self.table_name}", content=batch, headers=headers, params=self.params)
+        self.record_stage('network', time.perf_counter() - start)
+        if response.status_code >= 400:
+            raise PostgrestHTTPError(response)
+
+    def close(self):
+        self.session.close()
+
+ENGINES = {engine.name: engine for engine in (ExecuteBatchEngine, ExecuteValuesEngine, CopyEngine, SupabaseEngine)}
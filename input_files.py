@@ -0,0 +1,130 @@
+import io
+import os
+import sys
+import glob
+import gzip
+
+STDIN = '-'
+CSV_SUFFIXES = ('.csv', '.csv.gz', '.csv.zst', '.csv.zstd')
+
+# Function to expand the --csv arguments into a list of input files: globs are expanded and
+# directories stand for the CSV files in them (plain, .gz or .zst), both in sorted order, and
+# '-' means stdin
+def expand_inputs(patterns):
+    inputs = []
+    for pattern in patterns:
+        if pattern == STDIN:
+            matches = [STDIN]
+        elif os.path.isdir(pattern):
+            matches = sorted(os.path.join(pattern, name) for name in os.listdir(pattern) if name.lower().endswith(CSV_SUFFIXES))
+        elif glob.has_magic(pattern) and not os.path.exists(pattern):
+            matches = sorted(glob.glob(pattern))
+        else:
+            matches = [pattern]
+        if not matches:
+            raise ValueError(f"No CSV files match {pattern}")
+        inputs += [match for match in matches if match not in inputs]
+    if STDIN in inputs and len(inputs) > 1:
+        raise ValueError("stdin can't be combined with other input files")
+    return inputs
+
+# Function to tell whether an input is compressed or streamed, so that it can't be cut into
+# byte ranges
+def is_compressed(path):
+    return path == STDIN or path.lower().endswith(('.gz', '.zst', '.zstd'))
+
+# Binary reader over a stream that can't seek, such as a zstd decompressor or stdin. It keeps
+# track of the position itself and seeks forward by reading and discarding, so byte offsets
+# (checkpoints, dead-letter rows, parse blocks) work the same as for a plain file, just
+# decompressing again to get there. While `keep` is set nothing read is discarded, so the
+# stream can be read again from the start; stdin uses that to read the header and sample rows
+# before the upload reads it for real.
+class StreamInput:
+    chunk_size = 1024 * 1024
+
+    def __init__(self, stream, keep=False, close_stream=True):
+        self.stream = stream
+        self.read_chunk = getattr(stream, 'read1', stream.read)
+        self.keep = keep
+        self.close_stream = close_stream
+        self.buffer = b''
+        self.base = 0  # stream position of buffer[0]
+        self.pos = 0  # read position within buffer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Function to read the next chunk from the stream into the buffer; False at the end
+    def fill(self):
+        chunk = self.read_chunk(self.chunk_size)
+        if not chunk:
+            return False
+        if self.keep:
+            self.buffer += chunk
+        else:
+            self.base += self.pos
+            self.buffer = self.buffer[self.pos:] + chunk
+            self.pos = 0
+        return True
+
+    def readline(self):
+        while True:
+            end = self.buffer.find(b'\n', self.pos)
+            if end != -1 or not self.fill():
+                end = len(self.buffer) - 1 if end == -1 else end
+                line = self.buffer[self.pos:end + 1]
+                self.pos = end + 1
+                return line
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) - self.pos < size:
+            if not self.fill():
+                break
+        end = len(self.buffer) if size < 0 else min(self.pos + size, len(self.buffer))
+        data = self.buffer[self.pos:end]
+        self.pos = end
+        return data
+
+    def tell(self):
+        return self.base + self.pos
+
+    def seek(self, offset):
+        if offset < self.base:
+            raise io.UnsupportedOperation(f"Can't seek back to {offset} in a compressed or streamed input")
+        while offset > self.base + len(self.buffer):
+            self.pos = len(self.buffer)
+            if not self.fill():
+                break
+        self.pos = min(offset - self.base, len(self.buffer))
+
+    def close(self):
+        if self.close_stream:
+            self.stream.close()
+
+stdin_input = None
+
+# Function to open an input file for reading bytes, decompressing .gz and .zst files as a
+# stream (zstd needs the zstandard package). stdin is opened once: with peek, what is read is
+# kept and the next open starts from the beginning again; without it the upload takes over the
+# stream.
+def open_input(path, peek=False):
+    global stdin_input
+    if path == STDIN:
+        if stdin_input is None:
+            stdin_input = StreamInput(sys.stdin.buffer, keep=True, close_stream=False)
+        stdin_input.seek(0)
+        stdin_input.keep = peek
+        return stdin_input
+    lower_path = path.lower()
+    if lower_path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if lower_path.endswith(('.zst', '.zstd')):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(f"Reading {path} needs the zstandard package (pip install zstandard)")
+        return StreamInput(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+    return open(path, 'rb')
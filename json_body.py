@@ -0,0 +1,49 @@
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+from json.encoder import encode_basestring_ascii
+
+# Function to build the per-row template for a set of columns: a list with the escaped key
+# fragments ('{"id":', ',"name":', ...) at the even positions and room for the encoded values
+# at the odd ones, closed by '}'. It is cached so every batch (and every parsing worker
+# process) builds it only once.
+@lru_cache(maxsize=None)
+def row_template(columns):
+    template = []
+    for i, column in enumerate(columns):
+        template.append(('{' if i == 0 else ',') + encode_basestring_ascii(column) + ':')
+        template.append(None)
+    template.append('}')
+    return template
+
+# Function to encode a value that isn't a non-empty string: blanks and None are null, and the
+# typed values of schema.TypedRowConverter become JSON numbers, booleans or ISO 8601 strings
+def json_value(value):
+    if value is None or value == '':
+        return 'null'
+    if value is True or value is False:
+        return 'true' if value else 'false'
+    if isinstance(value, datetime):
+        return f'"{value.isoformat()}"'
+    if isinstance(value, Decimal) and not value.is_finite():
+        return f'"{value}"'
+    return str(value)
+
+# Function to encode parsed CSV rows straight into the JSON array body PostgREST expects,
+# with blanks as null. There is one object per line, so the body can be split between rows
+# on newlines (newlines inside values are escaped).
+def encode_json_rows(columns, rows):
+    template = list(row_template(tuple(columns)))
+    objects = []
+    for row in rows:
+        if len(row) != len(columns):
+            raise ValueError(f"Row has {len(row)} values but {len(columns)} columns are loaded")
+        template[1:-1:2] = [encode_basestring_ascii(value) if value.__class__ is str and value else json_value(value)
+                            for value in row]
+        objects.append(''.join(template))
+    return ('[' + ',\n'.join(objects) + ']').encode('ascii')
+
+# Function to split an encoded JSON array body after its first `count` rows
+def split_json_rows(body, count):
+    objects = body[1:-1].split(b',\n', count)
+    return b'[' + b',\n'.join(objects[:count]) + b']', b'[' + objects[count] + b']'
@@ -0,0 +1,242 @@
+import io
+import os
+import json
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# Stages an upload's time is split into. The reader thread spends its time reading the file,
+# parsing CSV records, mapping columns (transform), encoding batches (serialize) and waiting
+# for room in the insert window (backpressure); the insert workers spend theirs waiting for
+# the rate limiter (throttle), sending batches (network), committing them (commit) and
+# sleeping before retries (backoff). Stage times are summed over the insert workers (and the
+# parsing workers for parse/transform/serialize), so with concurrency they can add up to more
+# than the elapsed time.
+STAGES = ('read', 'parse', 'transform', 'serialize', 'backpressure', 'throttle', 'network', 'commit', 'backoff')
+
+# Running totals for an upload, shared between the reader and the insert workers. With a
+# writer (see MetricsWriter) every batch and the final totals are also written out.
+class UploadMetrics:
+    def __init__(self, writer=None):
+        self.start_time = time.time()
+        self.end_time = None
+        self.rows = 0
+        self.batches = 0
+        self.retries = 0
+        self.dead_letters = 0
+        self.bytes_sent = 0
+        self.batch_times = []
+        self.stage_times = dict.fromkeys(STAGES, 0.0)
+        self.writer = writer
+        self.lock = threading.Lock()
+
+    def record_batch(self, rows, batch_time, batch_bytes=0, end_row=None):
+        with self.lock:
+            self.rows += rows
+            self.batches += 1
+            self.bytes_sent += batch_bytes
+            self.batch_times.append(batch_time)
+        if self.writer is not None:
+            self.writer.write_batch(self, end_row, rows, batch_time, batch_bytes)
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    # The rows reported as inserted are the rows sent less the dead-lettered ones, so a row
+    # that was dead-lettered without being sent counts as a row too
+    def record_dead_letter(self, sent=True):
+        with self.lock:
+            self.dead_letters += 1
+            if not sent:
+                self.rows += 1
+
+    def record_stage(self, stage, seconds):
+        with self.lock:
+            self.stage_times[stage] += seconds
+
+    # Function to get a batch latency percentile (0-100) in seconds
+    def latency_percentile(self, percentile):
+        if not self.batch_times:
+            return 0
+        batch_times = sorted(self.batch_times)
+        return batch_times[min(len(batch_times) - 1, int(len(batch_times) * percentile / 100))]
+
+    # Function to stop the clock once the upload has finished
+    def finish(self):
+        self.end_time = time.time()
+        if self.writer is not None:
+            self.writer.write_summary(self)
+
+    def elapsed(self):
+        return (self.end_time or time.time()) - self.start_time
+
+    # Function to get the totals so far as a dict
+    def snapshot(self):
+        with self.lock:
+            elapsed = self.elapsed()
+            return {
+                'rows': self.rows - self.dead_letters,
+                'batches': self.batches,
+                'retries': self.retries,
+                'dead_letters': self.dead_letters,
+                'bytes_sent': self.bytes_sent,
+                'elapsed_seconds': round(elapsed, 3),
+                'rows_per_second': round(self.rows / elapsed, 1) if elapsed > 0 else 0,
+                'batch_p50_seconds': round(self.latency_percentile(50), 4),
+                'batch_p99_seconds': round(self.latency_percentile(99), 4),
+                'stage_seconds': {stage: round(seconds, 4) for stage, seconds in self.stage_times.items()},
+            }
+
+    def summary(self):
+        elapsed = self.elapsed()
+        rows_per_second = self.rows / elapsed if elapsed > 0 else 0
+        summary = (f"Inserted {self.rows - self.dead_letters} rows in {self.batches} batches with {self.retries} retries "
+                   f"in {elapsed:.2f} seconds ({rows_per_second:.0f} rows/sec)")
+        if self.dead_letters:
+            summary += f", {self.dead_letters} rows sent to the dead-letter file"
+        return summary
+
+    # Function to describe where the time went, largest stage first
+    def stage_summary(self):
+        stages = sorted(self.stage_times.items(), key=lambda item: item[1], reverse=True)
+        return "Time by stage: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stages if seconds > 0)
+
+# Writes upload metrics to a file as JSON lines (one line per batch plus a final summary
+# line) or in the Prometheus text format (the totals so far, rewritten at most every
+# `interval` seconds and at the end, e.g. for node_exporter's textfile collector). `labels`
+# are added to every line/metric, e.g. the table and engine.
+class MetricsWriter:
+    def __init__(self, path, format='jsonl', labels=None, interval=5):
+        self.path = path
+        self.format = format
+        self.labels = labels or {}
+        self.interval = interval
+        self.last_write = 0
+        self.lock = threading.Lock()
+        if format == 'jsonl':
+            self.file = open(path, 'a', encoding='utf-8')
+
+    def write_batch(self, metrics, end_row, rows, batch_time, batch_bytes):
+        if self.format == 'jsonl':
+            self.write_line({'event': 'batch', 'end_row': end_row, 'rows': rows, 'seconds': round(batch_time, 4),
+                             'bytes': batch_bytes})
+        elif time.time() - self.last_write >= self.interval:
+            self.write_prometheus(metrics.snapshot())
+
+    def write_summary(self, metrics):
+        if self.format == 'jsonl':
+            self.write_line(dict({'event': 'summary'}, **metrics.snapshot()))
+            self.file.close()
+        else:
+            self.write_prometheus(metrics.snapshot())
+
+    def write_line(self, entry):
+        entry = dict(entry, time=round(time.time(), 3), **self.labels)
+        with self.lock:
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+
+    # Function to write the totals as Prometheus metrics, replacing the file atomically
+    def write_prometheus(self, snapshot):
+        labels = ','.join(f'{name}="{value}"' for name, value in self.labels.items())
+        counters = [
+            ('upload_rows_total', 'counter', 'Rows inserted', snapshot['rows']),
+            ('upload_batches_total', 'counter', 'Batches inserted', snapshot['batches']),
+            ('upload_retries_total', 'counter', 'Batch retries', snapshot['retries']),
+            ('upload_dead_letters_total', 'counter', 'Rows written to the dead-letter file', snapshot['dead_letters']),
+            ('upload_bytes_sent_total', 'counter', 'Payload bytes sent', snapshot['bytes_sent']),
+            ('upload_elapsed_seconds', 'gauge', 'Seconds since the upload started', snapshot['elapsed_seconds']),
+            ('upload_rows_per_second', 'gauge', 'Average rows inserted per second', snapshot['rows_per_second']),
+        ]
+        lines = []
+        for name, kind, help_text, value in counters:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name}{{{labels}}} {value}"]
+        lines += ["# HELP upload_batch_seconds Batch insert latency", "# TYPE upload_batch_seconds summary"]
+        for quantile, key in (('0.5', 'batch_p50_seconds'), ('0.99', 'batch_p99_seconds')):
+            lines.append(f'upload_batch_seconds{{{labels}{"," if labels else ""}quantile="{quantile}"}} {snapshot[key]}')
+        lines += ["# HELP upload_stage_seconds_total Seconds spent in each stage of the upload",
+                  "# TYPE upload_stage_seconds_total counter"]
+        for stage, seconds in snapshot['stage_seconds'].items():
+            lines.append(f'upload_stage_seconds_total{{{labels}{"," if labels else ""}stage="{stage}"}} {seconds}')
+        with self.lock:
+            with open(f"{self.path}.tmp", 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.replace(f"{self.path}.tmp", self.path)
+            self.last_write = time.time()
+
+# Profiles an upload with cProfile and/or tracemalloc. cProfile only sees the thread that
+# enabled it, so functions run on the insert workers are wrapped with wrap(), which profiles
+# each worker thread separately; all the profiles are merged into one stats file at the end.
+class RunProfiler:
+    def __init__(self, profile_path=None, trace_memory=False, top=20):
+        self.profile_path = profile_path
+        self.trace_memory = trace_memory
+        self.top = top
+        self.profiles = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    # Function to get the calling thread's profiler
+    def thread_profile(self):
+        profile = getattr(self.local, 'profile', None)
+        if profile is None:
+            profile = self.local.profile = cProfile.Profile()
+            with self.lock:
+                self.profiles.append(profile)
+        return profile
+
+    # Function to wrap a function so that its calls are profiled on whatever thread runs them
+    def wrap(self, function):
+        if self.profile_path is None:
+            return function
+
+        def profiled(*args, **kwargs):
+            profile = self.thread_profile()
+            profile.enable()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profile.disable()
+        return profiled
+
+    # Context manager to profile the code run inside it on the current thread
+    @contextmanager
+    def running(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        profile = self.thread_profile() if self.profile_path else None
+        if profile is not None:
+            profile.enable()
+        try:
+            yield self
+        finally:
+            if profile is not None:
+                profile.disable()
+                self.report_profile()
+            if self.trace_memory:
+                self.report_memory()
+                tracemalloc.stop()
+
+    def report_profile(self):
+        with self.lock:
+            stats = pstats.Stats(self.profiles[0])
+            for profile in self.profiles[1:]:
+                stats.add(profile)
+        stats.dump_stats(self.profile_path)
+        output = io.StringIO()
+        stats.stream = output
+        stats.sort_stats('cumulative').print_stats(self.top)
+        logging.info(f"Profile written to {self.profile_path}\n{output.getvalue()}")
+        print(f"Profile written to {self.profile_path}\n{output.getvalue()}")
+
+    def report_memory(self):
+        current, peak = tracemalloc.get_traced_memory()
+        top_lines = tracemalloc.take_snapshot().statistics('lineno')[:self.top]
+        report = '\n'.join(str(line) for line in top_lines)
+        logging.info(f"Traced memory: {current / 1024 / 1024:.1f}MB now, {peak / 1024 / 1024:.1f}MB peak\n{report}")
+        print(f"Traced memory: {current / 1024 / 1024:.1f}MB now, {peak / 1024 / 1024:.1f}MB peak\n{report}")
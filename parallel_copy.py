@@ -0,0 +1,150 @@
+import json
+import mmap
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from csv_chunks import read_header
+from row_offsets import RowOffsetIndex, MappedRangeReader
+from copy_stream import TransformingCopyStream, column_selector, build_copy_sql
+from engines import create_connection, db_config_from_env
+from rate_limit import backoff_delay
+
+# Error for a chunk that still failed after retrying. When an attempt's commit failed and no
+# connection could tell afterwards whether it went through, txid is that attempt's transaction.
+class ChunkCopyError(Exception):
+    def __init__(self, error, txid=None):
+        super().__init__(str(error))
+        self.txid = txid
+
+# Function to COPY one byte range of the CSV on its own connection and commit it, reading it
+# straight out of a memory mapping of the file.
+# Connection errors, including failing to reconnect, retry just this chunk, backing off
+# exponentially; anything else fails the chunk.
+# The transaction id is recorded before the commit, so that when the commit itself fails the
+# chunk is only copied again once a connection has confirmed that the transaction didn't commit.
+# txid is such a transaction from an earlier run, which is checked the same way first.
+# With a header the range is streamed through TransformingCopyStream first.
+def copy_chunk(db_config, csv_file_path, copy_sql, start, end, max_retries=3, retry_delay=1, header=None, column_map=None,
+               max_retry_delay=60, txid=None):
+    import psycopg2
+    retry_count = 0
+    while True:
+        conn = None
+        cur = None
+        try:
+            conn = create_connection(db_config)
+            cur = conn.cursor()
+            start_time = time.time()
+            if txid is not None:
+                cur.execute("SELECT txid_status(%s)", (txid,))
+                status = cur.fetchone()[0]
+                if status == 'committed':
+                    logging.info(f"Bytes {start}-{end} were committed before the error, not copying them again")
+                    print(f"Bytes {start}-{end} were committed before the error, not copying them again")
+                    return time.time() - start_time
+                if status == 'in progress':
+                    # The server hasn't finished with the lost connection yet; ask again later
+                    raise psycopg2.OperationalError(f"transaction {txid} of the previous attempt is still in progress")
+                conn.rollback()
+                txid = None
+            cur.execute("SET statement_timeout TO 0;")
+            with open(csv_file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                stream = MappedRangeReader(mapped, start, end)
+                if header is not None:
+                    lines = (line.decode('ISO-8859-1') for line in stream)
+                    stream = TransformingCopyStream(lines, header, column_map)
+                cur.copy_expert(copy_sql, stream, size=1024 * 1024)
+                cur.execute("SELECT txid_current()")
+                txid = cur.fetchone()[0]
+                conn.commit()
+                return time.time() - start_time
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            logging.error(f"Error copying bytes {start}-{end}: {e}")
+            print(f"Error copying bytes {start}-{end}: {e}")
+            retry_count += 1
+            if retry_count > max_retries:
+                raise ChunkCopyError(e, txid) from e
+            wait = backoff_delay(retry_count, retry_delay, max_retry_delay)
+            logging.info(f"Retrying bytes {start}-{end} in {wait:.2f} seconds, attempt {retry_count}")
+            print(f"Retrying bytes {start}-{end} in {wait:.2f} seconds, attempt {retry_count}")
+            time.sleep(wait)  # Wait before retrying
+        finally:
+            if cur is not None:
+                cur.close()
+            if conn is not None:
+                conn.close()
+
+# Function to upload CSV to PostgreSQL using several COPY streams at once. The file is split
+# into byte ranges on record boundaries (using its row offset index, see row_offsets) and
+# every range is loaded and committed on its own connection; parallel=1 with num_chunks=1 is
+# a single COPY of the whole file in one transaction. Without a column_map the raw bytes are
+# sent as-is; with one, every chunk is streamed through TransformingCopyStream. Ranges that
+# still fail after retrying are written to failed_chunks_path so that a later run with
+# retry_failed=True loads only those. A range whose commit may have gone through is written
+# with the id of that transaction, and the later run only copies it if it didn't commit.
+# Returns True when every chunk was loaded.
+def upload_csv_using_parallel_copy(csv_file_path, table_name, parallel=4, num_chunks=None, failed_chunks_path=None, retry_failed=False,
+                                   column_map=None, max_retries=3, retry_delay=1, db_config=None, max_retry_delay=60):
+    db_config = db_config or db_config_from_env()
+    header = read_header(csv_file_path)
+    if column_map is not None:
+        columns, _ = column_selector(header, column_map)
+        copy_sql = build_copy_sql(table_name, columns)
+        transform_header = header
+    else:
+        escaped_header = [f'"{col}"' for col in header]
+        copy_sql = f"COPY {table_name} ({', '.join(escaped_header)}) FROM STDIN WITH (FORMAT csv, ENCODING 'LATIN1')"
+        transform_header = None
+
+    start_time = datetime.now()
+    if retry_failed:
+        with open(failed_chunks_path, 'r') as f:
+            chunks = [tuple(chunk) for chunk in json.load(f)]
+    else:
+        with RowOffsetIndex(csv_file_path) as index:
+            chunks = index.split(num_chunks or (parallel * 4 if parallel > 1 else 1))
+    split_duration = (datetime.now() - start_time).total_seconds()
+    logging.info(f"Loading {len(chunks)} chunks over {parallel} connections (split in {split_duration:.2f} seconds)")
+    print(f"Loading {len(chunks)} chunks over {parallel} connections (split in {split_duration:.2f} seconds)")
+
+    failed_chunks = []
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = {executor.submit(copy_chunk, db_config, csv_file_path, copy_sql, chunk[0], chunk[1], max_retries, retry_delay,
+                                   header=transform_header, column_map=column_map, max_retry_delay=max_retry_delay,
+                                   txid=chunk[2] if len(chunk) > 2 else None): chunk
+                   for chunk in chunks}
+        for future in as_completed(futures):
+            start, end = futures[future][:2]
+            try:
+                chunk_time = future.result()
+                logging.info(f"Copied bytes {start}-{end} in {chunk_time:.2f} seconds")
+                print(f"Copied bytes {start}-{end} in {chunk_time:.2f} seconds")
+            except ChunkCopyError as e:
+                if e.txid is None:
+                    logging.error(f"Failed to copy bytes {start}-{end}: {e}")
+                    print(f"Failed to copy bytes {start}-{end}: {e}")
+                    failed_chunks.append((start, end))
+                else:
+                    logging.error(f"Failed to copy bytes {start}-{end}: {e}; transaction {e.txid} may have committed them, "
+                                  f"--retry-failed checks it before copying them again")
+                    print(f"Failed to copy bytes {start}-{end}: {e}; transaction {e.txid} may have committed them, "
+                          f"--retry-failed checks it before copying them again")
+                    failed_chunks.append((start, end, e.txid))
+            except Exception as e:
+                logging.error(f"Failed to copy bytes {start}-{end}: {e}")
+                print(f"Failed to copy bytes {start}-{end}: {e}")
+                failed_chunks.append(futures[future][:2])
+
+    if failed_chunks_path:
+        with open(failed_chunks_path, 'w') as f:
+            json.dump(sorted(failed_chunks), f)
+
+    duration = (datetime.now() - start_time).total_seconds()
+    if failed_chunks:
+        logging.error(f"{len(failed_chunks)} of {len(chunks)} chunks failed, rerun with --retry-failed to load them")
+        print(f"{len(failed_chunks)} of {len(chunks)} chunks failed, rerun with --retry-failed to load them")
+        return False
+    logging.info(f"Copied {len(chunks)} chunks in {duration:.2f} seconds")
+    print(f"Copied {len(chunks)} chunks in {duration:.2f} seconds")
+    return True
@@ -0,0 +1,107 @@
+import io
+import csv
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from checkpoint import OffsetLineReader
+from csv_chunks import read_record_blocks
+
+# Function to parse one block of whole CSV records and encode it into batches. Runs in a
+# worker process. Rows that don't have `width` values are left out of the batches. Returns a
+# list of (row_numbers, row_starts, row_ends, payload) tuples, one per batch, with the number
+# of every row within the block and its start and end offsets relative to the start of the
+# block; the rows left out as (row number, start, end, value count); the number of records in
+# the block; and the seconds spent parsing, transforming and serializing.
+def parse_block(data, encode_rows, columns, select, batch_size, width):
+    start = time.perf_counter()
+    line_reader = OffsetLineReader(io.BytesIO(data))
+    batches = []
+    rejected = []
+    rows = []
+    positions = (array('q'), array('q'), array('q'))
+    timings = {'transform': 0.0, 'serialize': 0.0}
+
+    # Function to map and encode the rows collected so far into a batch
+    def add_batch():
+        mapped = time.perf_counter()
+        batch_rows = rows if select is None else [select(row) for row in rows]
+        encoded = time.perf_counter()
+        batches.append((*positions, encode_rows(columns, batch_rows)))
+        timings['transform'] += encoded - mapped
+        timings['serialize'] += time.perf_counter() - encoded
+
+    count = 0
+    row_start = 0
+    for row in csv.reader(line_reader):
+        count += 1
+        if len(row) != width:
+            rejected.append((count, row_start, line_reader.offset, len(row)))
+        else:
+            rows.append(row)
+            positions[0].append(count)
+            positions[1].append(row_start)
+            positions[2].append(line_reader.offset)
+            if len(rows) >= batch_size:
+                add_batch()
+                rows = []
+                positions = (array('q'), array('q'), array('q'))
+        row_start = line_reader.offset
+    if rows:
+        add_batch()
+    timings['parse'] = time.perf_counter() - start - timings['transform'] - timings['serialize']
+    return batches, rejected, count, timings
+
+# Function to parse and encode a CSV file in a pool of worker processes, starting at a record
+# boundary (start_offset, just after file row start_row). f is the file opened for reading
+# bytes (see input_files.open_input), so compressed files and stdin work as they stream. The
+# file is cut into blocks of whole records that the workers turn into encoded batches; at most
+# two blocks per worker are queued or held, so reading stays just ahead of the upload. Yields
+# (payload, batch_start_row, row_numbers, row_starts, row_ends, records) in file order, with
+# the file row number and start and end offset of every row. batch_size is called for every block so an
+# adaptive batch size is picked up as it changes. Rows that don't have `width` values (the
+# header's) are not sent; reject_row is called with their row number, start and end offset,
+# value count and record text. With keep_records a list with the raw text of every record is
+# also yielded (None otherwise), and passed to reject_row. Stage timings go to record_stage if
+# given.
+def parse_batches_in_processes(f, start_offset, start_row, encode_rows, columns, select, batch_size, workers, width,
+                               reject_row, keep_records=False, block_size=4 * 1024 * 1024, record_stage=None):
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        blocks = read_record_blocks(f, start_offset, block_size)
+        queued = deque()
+        block_row = start_row
+        batch_start_row = start_row
+        while True:
+            while len(queued) < workers * 2:
+                read_start = time.perf_counter()
+                block = next(blocks, None)
+                if record_stage is not None:
+                    record_stage('read', time.perf_counter() - read_start)
+                if block is None:
+                    break
+                block_offset, data = block
+                queued.append((block_offset, data if keep_records else None,
+                               executor.submit(parse_block, data, encode_rows, columns, select, batch_size(), width)))
+            if not queued:
+                break
+            block_offset, data, future = queued.popleft()
+            batches, rejected, count, timings = future.result()
+            if record_stage is not None:
+                for stage, seconds in timings.items():
+                    record_stage(stage, seconds)
+            for row, row_start, row_end, values in rejected:
+                record = data[row_start:row_end].decode('ISO-8859-1') if keep_records else None
+                reject_row(block_row + row, block_offset + row_start, block_offset + row_end, values, record)
+            for row_numbers, row_starts, row_ends, payload in batches:
+                records = None
+                if keep_records:
+                    records = [data[row_start:row_end].decode('ISO-8859-1') for row_start, row_end in zip(row_starts, row_ends)]
+                row_numbers = array('q', [block_row + row for row in row_numbers])
+                row_starts = array('q', [block_offset + row_start for row_start in row_starts])
+                row_ends = array('q', [block_offset + row_end for row_end in row_ends])
+                yield payload, batch_start_row, row_numbers, row_starts, row_ends, records
+                batch_start_row = row_numbers[-1]
+            block_row += count
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,78 @@
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# Token bucket that lets `rate` tokens through per second with bursts of up to `capacity`.
+# acquire() reserves its tokens straight away and then sleeps off any debt, so callers on
+# several threads are served in the order they asked and a request bigger than the bucket
+# still gets through (it just waits longer).
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Function to take `tokens` from the bucket, returning how many seconds the caller must wait
+    def reserve(self, tokens):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+# Rate limit shared by every insert worker: an optional rows/sec budget and an optional
+# requests/sec budget, plus a pause that a throttled worker can put on all of them
+class RateLimiter:
+    def __init__(self, rows_per_second=None, requests_per_second=None):
+        self.rows = TokenBucket(rows_per_second) if rows_per_second else None
+        self.requests = TokenBucket(requests_per_second, 1) if requests_per_second else None
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    # Function to wait until a request with `rows` rows may be sent
+    def acquire(self, rows):
+        wait = self.paused_until - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        if self.requests is not None:
+            self.requests.acquire(1)
+        if self.rows is not None:
+            self.rows.acquire(rows)
+
+    # Function to hold back every worker for `seconds`, e.g. after the server answered 429
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+# Function to get the wait before retry number `attempt` (1-based): exponential backoff from
+# base_delay capped at max_delay, with full jitter so workers that failed together don't
+# retry together
+def backoff_delay(attempt, base_delay=1, max_delay=60):
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+# Function to parse a Retry-After header value (seconds or an HTTP date) into seconds to wait
+def parse_retry_after(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
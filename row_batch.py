@@ -0,0 +1,37 @@
+# Compact container for one batch of rows: every value of the batch in one flat list, row
+# after row, with blanks already turned into None (NULL). Unlike a tuple or dict per row it is
+# a single object for the garbage collector to track, and it pickles as one list when batches
+# come back from parsing worker processes.
+class RowBatch:
+    __slots__ = ('columns', 'width', 'values')
+
+    def __init__(self, columns, values):
+        self.columns = columns
+        self.width = len(columns)
+        self.values = values
+
+    # A row with more or fewer values than there are columns would shift every later value
+    # of the flat list into the wrong column, so it is rejected instead
+    @classmethod
+    def from_rows(cls, columns, rows):
+        width = len(columns)
+        for row in rows:
+            if len(row) != width:
+                raise ValueError(f"Row has {len(row)} values but {width} columns are loaded")
+        return cls(columns, [None if value == '' else value for row in rows for value in row])
+
+    def __len__(self):
+        return len(self.values) // self.width
+
+    # Slicing by rows, e.g. batch[:count], gives a new RowBatch
+    def __getitem__(self, rows):
+        width = self.width
+        start, stop, _ = rows.indices(len(self))
+        return RowBatch(self.columns, self.values[start * width:stop * width])
+
+    # Function to iterate over the rows, each as a short-lived list
+    def rows(self):
+        values = self.values
+        width = self.width
+        for i in range(0, len(values), width):
+            yield values[i:i + width]
@@ -0,0 +1,141 @@
+import os
+import sqlite3
+import threading
+from hashlib import blake2b
+
+# Function to build the default row index path for a table
+def default_row_index_path(table_name):
+    return f"{table_name}_row_index.sqlite"
+
+# Function to hash CSV values into a signed 64-bit integer (what SQLite stores as an integer key)
+def hash_values(values):
+    return int.from_bytes(blake2b('\x1f'.join(values).encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+# Local index of the rows already loaded into a table, for incremental reloads. It is a SQLite
+# file mapping a hash of each row's key (the key_indices CSV columns, or the whole row when
+# there is no key) to a hash of the whole row. filter() drops the rows whose hash matches,
+# so only new and changed rows are sent. Rows are only recorded once their batch commits
+# (commit()), and rows that end up in the dead-letter file never are (discard()), so a failed
+# or interrupted load doesn't hide rows from the next run. Within a file the first row with a
+# key wins: a later row with the same key and the same values is skipped as a duplicate, and
+# one with different values is handed to filter()'s reject function instead of being sent. The
+# keys used so far in the file are kept in the index too (start_file() clears them unless the
+# same file is resumed), so this doesn't depend on whether the first row has committed yet.
+class RowIndex:
+    lookup_size = 500
+
+    def __init__(self, path, key_indices=None, reset=False):
+        self.path = path
+        self.key_indices = key_indices
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        if reset:
+            self.db.execute("DROP TABLE IF EXISTS rows")
+        self.db.execute("CREATE TABLE IF NOT EXISTS rows (key INTEGER PRIMARY KEY, hash INTEGER NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS file_rows (key INTEGER PRIMARY KEY, row INTEGER NOT NULL, hash INTEGER NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS file (path TEXT NOT NULL)")
+        self.db.commit()
+        self.pending = {}  # row number -> (key, hash) for rows sent but not committed yet
+        self.new = 0
+        self.changed = 0
+        self.unchanged = 0
+        self.duplicates = 0
+        self.conflicts = 0
+
+    # Function to start checking the rows of a CSV file; a resumed file keeps the keys its
+    # earlier rows used
+    def start_file(self, csv_file_path, resume=False):
+        path = os.path.abspath(csv_file_path)
+        with self.lock:
+            if not resume or self.db.execute("SELECT path FROM file").fetchone() != (path,):
+                self.db.execute("DELETE FROM file_rows")
+                self.db.execute("DELETE FROM file")
+                self.db.execute("INSERT INTO file (path) VALUES (?)", (path,))
+                self.db.commit()
+
+    # Function to look up rows for a list of keys in chunks; returns key -> the selected columns
+    def lookup(self, sql, keys):
+        found = {}
+        for i in range(0, len(keys), self.lookup_size):
+            chunk = keys[i:i + self.lookup_size]
+            for key, *values in self.db.execute(sql.format(','.join('?' * len(chunk))), chunk):
+                found[key] = values
+        return found
+
+    # Function to look up the stored row hashes for a list of keys
+    def stored_hashes(self, keys):
+        return {key: values[0] for key, values in self.lookup("SELECT key, hash FROM rows WHERE key IN ({})", keys).items()}
+
+    # Function to filter (row_number, row, ...) entries down to the rows that are new or
+    # changed, remembering them as pending. reject(entry, first_row) is called for every row
+    # whose key an earlier row of the file already used with different values.
+    def filter(self, entries, reject):
+        hashes = [hash_values(entry[1]) for entry in entries]
+        if self.key_indices is None:
+            keys = hashes
+        else:
+            keys = [hash_values([entry[1][i] for i in self.key_indices]) for entry in entries]
+        with self.lock:
+            kept, rejected = self.filter_hashed(entries, keys, hashes)
+        for entry, first_row in rejected:
+            reject(entry, first_row)
+        return kept
+
+    # Function to compare hashed entries against the index and the keys used earlier in the
+    # file; called with the lock held. Returns the entries to send and (entry, first row) pairs
+    # for the rejected ones.
+    def filter_hashed(self, entries, keys, hashes):
+        stored = self.stored_hashes(keys)
+        earlier = self.lookup("SELECT key, row, hash FROM file_rows WHERE key IN ({})", keys)
+        first_rows = []
+        kept = []
+        rejected = []
+        for entry, key, row_hash in zip(entries, keys, hashes):
+            first = earlier.get(key)
+            # A resumed file reads the rows after the checkpoint again, which may have been
+            # recorded by the run that stopped
+            if first is not None and first[0] != entry[0]:
+                if first[1] == row_hash:
+                    self.duplicates += 1
+                else:
+                    self.conflicts += 1
+                    rejected.append((entry, first[0]))
+                continue
+            earlier[key] = (entry[0], row_hash)
+            first_rows.append((key, entry[0], row_hash))
+            stored_hash = stored.get(key)
+            if stored_hash == row_hash:
+                self.unchanged += 1
+                continue
+            if stored_hash is None:
+                self.new += 1
+            else:
+                self.changed += 1
+            self.pending[entry[0]] = (key, row_hash)
+            kept.append(entry)
+        self.db.executemany("INSERT OR REPLACE INTO file_rows (key, row, hash) VALUES (?, ?, ?)", first_rows)
+        return kept, rejected
+
+    # Function to record the pending rows among file rows start_row+1 .. end_row as loaded
+    def commit(self, start_row, end_row):
+        with self.lock:
+            rows = [row for row in self.pending if start_row < row <= end_row]
+            entries = [self.pending.pop(row) for row in rows]
+            self.db.executemany("INSERT OR REPLACE INTO rows (key, hash) VALUES (?, ?)", entries)
+            self.db.commit()
+
+    # Function to forget a pending row that could not be loaded
+    def discard(self, row_number):
+        with self.lock:
+            self.pending.pop(row_number, None)
+
+    def summary(self):
+        return (f"Row index: {self.new} new, {self.changed} changed, {self.unchanged} unchanged "
+                f"and {self.duplicates} duplicate rows, {self.conflicts} rows repeating an earlier row's key")
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
@@ -0,0 +1,151 @@
+import os
+import re
+import json
+import mmap
+import logging
+from array import array
+from bisect import bisect_right
+
+# One CSV record: unquoted text and quoted sections ("" escapes are two sections in a row),
+# up to the newline that ends it, or the end of the file. The possessive quantifiers keep the
+# regex engine from backtracking, so a record is matched in one pass over its bytes.
+RECORD = rb'[^"\n]*+(?:"[^"]*+"[^"\n]*+)*+'
+RECORD_PATTERN = re.compile(RECORD + rb'(?:\n|\Z)')
+
+# Function to build the default row offset index path for a CSV file (kept next to the file)
+def default_row_offsets_path(csv_file_path):
+    return f"{csv_file_path}.row_offsets.json"
+
+# Memory-mapped view of a CSV file with a sparse index of where its records start: the byte
+# offset of every `step`-th data row. Records are matched by RECORD_PATTERN straight off the
+# mapping, so quoted newlines are handled without decoding or parsing any row, and the index
+# is built by matching `step` records at a time. Finding the start of row N is then an index
+# lookup plus a walk over at most `step` records, which makes skipping rows and cutting the
+# file into chunks cheap no matter how far into the file they are. The index is cached on
+# disk, keyed on the file's size and modification time so an edited file gets a new one.
+class RowOffsetIndex:
+    def __init__(self, csv_file_path, step=1000, cache_path=None):
+        self.csv_file_path = csv_file_path
+        self.step = step
+        self.step_pattern = re.compile(rb'(?:' + RECORD + rb'\n){%d}' % step)
+        self.cache_path = cache_path or default_row_offsets_path(csv_file_path)
+        self.file = open(csv_file_path, 'rb')
+        stat = os.fstat(self.file.fileno())
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        # mmap can't map an empty file
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self.data_start = self.skip_records(0, 1)
+        self.offsets = None
+        self.rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Function to walk forward from a record start over `count` records, returning the offset
+    # of the record after them (or the end of the file)
+    def skip_records(self, offset, count):
+        for _ in range(count):
+            if offset >= self.size:
+                break
+            match = RECORD_PATTERN.match(self.map, offset)
+            offset = match.end() if match else self.size  # An unclosed quote runs to the end
+        return offset
+
+    # Function to load the cached index, or build and cache it
+    def load(self):
+        if self.offsets is not None:
+            return
+        try:
+            with open(self.cache_path, 'r') as f:
+                cached = json.load(f)
+            if (cached['size'], cached['mtime_ns'], cached['step']) == (self.size, self.mtime_ns, self.step):
+                self.offsets = array('q', cached['offsets'])
+                self.rows = cached['rows']
+                return
+        except (OSError, ValueError, KeyError):
+            pass
+        self.build()
+        try:
+            with open(self.cache_path, 'w') as f:
+                json.dump({'csv_file': os.path.abspath(self.csv_file_path), 'size': self.size, 'mtime_ns': self.mtime_ns,
+                           'step': self.step, 'rows': self.rows, 'offsets': self.offsets.tolist()}, f)
+        except OSError as e:
+            logging.info(f"Could not cache the row offsets of {self.csv_file_path} in {self.cache_path}: {e}")
+            print(f"Could not cache the row offsets of {self.csv_file_path} in {self.cache_path}: {e}")
+
+    # Function to scan the file and record the start of every step-th record, matching `step`
+    # records at a time and single records for the last few
+    def build(self):
+        offsets = array('q')
+        rows = 0
+        offset = self.data_start
+        while offset < self.size:
+            match = None
+            if rows % self.step == 0:
+                offsets.append(offset)
+                match = self.step_pattern.match(self.map, offset)
+            if match:
+                offset = match.end()
+                rows += self.step
+            else:
+                offset = self.skip_records(offset, 1)
+                rows += 1
+        self.offsets = offsets
+        self.rows = rows
+
+    # Function to get the byte offset just past the first `row` data rows
+    def offset_of_row(self, row):
+        self.load()
+        if row >= self.rows:
+            return self.size
+        k = row // self.step
+        return self.skip_records(self.offsets[k], row - k * self.step)
+
+    # Function to split the data rows into roughly equal byte ranges that each start and end on
+    # a record boundary, walking from the nearest indexed row to each cut
+    def split(self, num_chunks):
+        self.load()
+        data_size = self.size - self.data_start
+        boundaries = [self.data_start]
+        for k in range(1, num_chunks):
+            target = self.data_start + data_size * k // num_chunks
+            offset = self.offsets[bisect_right(self.offsets, target) - 1] if self.offsets else self.data_start
+            while offset < target:
+                offset = self.skip_records(offset, 1)
+            if offset > boundaries[-1]:
+                boundaries.append(offset)
+        boundaries.append(self.size)
+        return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+    def close(self):
+        if self.size:
+            self.map.close()
+        self.file.close()
+
+# Read-only file-like view over one byte range of a memory-mapped file, suitable for
+# cursor.copy_expert. Every read is a single slice of the mapping, with no read() calls or
+# buffering in between (psycopg2 needs bytes, so that slice is the one copy on the way to the
+# socket).
+class MappedRangeReader:
+    def __init__(self, mapped, start, end):
+        self.map = mapped
+        self.offset = start
+        self.end = end
+
+    def read(self, size=-1):
+        end = self.end if size < 0 else min(self.offset + size, self.end)
+        data = self.map[self.offset:end]
+        self.offset = end
+        return data
+
+    def readline(self):
+        newline = self.map.find(b'\n', self.offset, self.end)
+        end = self.end if newline == -1 else newline + 1
+        return self.read(end - self.offset)
+
+    def __iter__(self):
+        return iter(self.readline, b'')
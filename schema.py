@@ -0,0 +1,133 @@
+import re
+import csv
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from engines import create_connection
+from checkpoint import OffsetLineReader
+from input_files import open_input
+
+# Numbers are only inferred as written canonically: converting 02134 or +5 would silently drop
+# the leading zero (ZIP codes, zero-padded ids) or the sign, so such columns stay text
+INTEGER_PATTERN = re.compile(r'\s*-?(0|[1-9]\d*)\s*')
+NUMERIC_PATTERN = re.compile(r'\s*-?((0|[1-9]\d*)(\.\d*)?|\.\d+)([eE][+-]?\d+)?\s*')
+BOOLEAN_VALUES = {'true': True, 't': True, 'yes': True, 'false': False, 'f': False, 'no': False}
+BIGINT_RANGE = (-2 ** 63, 2 ** 63 - 1)
+
+# Timestamp formats tried after ISO 8601, e.g. the 5/29/2024 dates of spreadsheet exports
+TIMESTAMP_FORMATS = ('%m/%d/%Y', '%m/%d/%Y %H:%M', '%m/%d/%Y %H:%M:%S', '%m/%d/%Y %I:%M %p', '%m/%d/%Y %I:%M:%S %p',
+                     '%Y/%m/%d', '%Y/%m/%d %H:%M:%S', '%d.%m.%Y', '%d.%m.%Y %H:%M:%S')
+
+# Converters from CSV text to the Python value for a column type. A value that doesn't convert
+# is passed on unchanged, so a bad value past the sampled rows is rejected by the server for
+# that row (and dead-lettered) instead of failing the whole batch here.
+def to_integer(value):
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+def to_numeric(value):
+    try:
+        return Decimal(value.strip())
+    except InvalidOperation:
+        return value
+
+def to_boolean(value):
+    return BOOLEAN_VALUES.get(value.strip().lower(), value)
+
+# Converts timestamps in one strptime format, or ISO 8601 when the format is None
+class TimestampConverter:
+    def __init__(self, format=None):
+        self.format = format
+
+    def __call__(self, value):
+        try:
+            if self.format is None:
+                return datetime.fromisoformat(value.strip())
+            return datetime.strptime(value.strip(), self.format)
+        except ValueError:
+            return value
+
+# Function to tell whether every sampled value of a column passes a check
+def all_values(values, check):
+    try:
+        return all(check(value) for value in values)
+    except ValueError:
+        return False
+
+def is_integer(value):
+    return INTEGER_PATTERN.fullmatch(value) is not None and BIGINT_RANGE[0] <= int(value) <= BIGINT_RANGE[1]
+
+def is_numeric(value):
+    return NUMERIC_PATTERN.fullmatch(value) is not None
+
+def is_boolean(value):
+    return value.strip().lower() in BOOLEAN_VALUES
+
+# Function to pick the narrowest type that fits every non-blank sampled value of a column.
+# Returns (postgres_type, converter); text columns have no converter.
+def infer_type(values):
+    values = [value for value in values if value.strip()]
+    if not values:
+        return 'text', None
+    if all_values(values, is_integer):
+        return 'bigint', to_integer
+    if all_values(values, is_numeric):
+        return 'numeric', to_numeric
+    if all_values(values, is_boolean):
+        return 'boolean', to_boolean
+    for format in (None,) + TIMESTAMP_FORMATS:
+        converter = TimestampConverter(format)
+        if all_values(values, lambda value: isinstance(converter(value), datetime)):
+            aware = any(converter(value).tzinfo is not None for value in values)
+            return 'timestamptz' if aware else 'timestamp', converter
+    return 'text', None
+
+# Function to infer the column types of a CSV file from its first sample_rows data rows, after
+# the column selector (see copy_stream.column_selector). Returns a list of
+# (postgres_type, converter) pairs, one per target column.
+def infer_column_types(csv_file_path, select=None, sample_rows=1000):
+    with open_input(csv_file_path, peek=True) as f:
+        reader = csv.reader(OffsetLineReader(f))
+        header = next(reader)
+        rows = [row if select is None else list(select(row)) for row in islice(reader, sample_rows)]
+    width = len(rows[0]) if rows else len(header)
+    return [infer_type([row[i] for row in rows if i < len(row)]) for i in range(width)]
+
+# Function to build the CREATE TABLE statement for the target columns and their inferred
+# types, with the key columns (if any) as the primary key
+def create_table_sql(table_name, columns, column_types, key=None):
+    definitions = [f'"{column}" {column_type}' for column, (column_type, _) in zip(columns, column_types)]
+    if key:
+        escaped_key = ', '.join(f'"{column}"' for column in key)
+        definitions.append(f"PRIMARY KEY ({escaped_key})")
+    return f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(definitions)})"
+
+# Function to create the target table over a direct PostgreSQL connection (for Supabase, the
+# DB_* settings of the project's database)
+def create_table(db_config, sql):
+    conn = create_connection(db_config)
+    try:
+        cur = conn.cursor()
+        try:
+            cur.execute(sql)
+        finally:
+            cur.close()
+        conn.commit()
+    finally:
+        conn.close()
+
+# Row function that applies the column selector and then converts every value to its column's
+# type, with blanks as None. It is used in place of the selector, so conversion happens on the
+# reader thread or in the parsing worker processes, and it pickles for the latter.
+class TypedRowConverter:
+    def __init__(self, column_types, select=None):
+        self.select = select
+        self.converters = [converter for _, converter in column_types]
+
+    def __call__(self, row):
+        if self.select is not None:
+            row = self.select(row)
+        return [None if value == '' else value if converter is None else converter(value)
+                for value, converter in zip(row, self.converters)]
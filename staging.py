@@ -0,0 +1,161 @@
+import re
+import time
+import logging
+from engines import create_connection, db_config_from_env
+
+# Matches pg_get_indexdef output: CREATE [UNIQUE] INDEX name ON [ONLY] table USING ...
+IDENTIFIER = r'(?:"[^"]*(?:""[^"]*)*"|\S+)'
+INDEX_DEF_PATTERN = re.compile(rf'^(CREATE (?:UNIQUE )?INDEX ){IDENTIFIER}( ON (?:ONLY )?){IDENTIFIER}( USING .*)$', re.S)
+
+# Function to quote an identifier for SQL
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+# Function to build a temporary name for an index or constraint while the staging table and
+# the live table both exist, within PostgreSQL's 63 character limit
+def staging_name(name):
+    return name[:55] + '_staging'
+
+# Bulk-load mode that loads into an UNLOGGED copy of the target table with no indexes or
+# constraints, so the rows skip the WAL and index maintenance, and then swaps it in:
+#   1. create(): CREATE UNLOGGED TABLE <table>_staging (LIKE <table>), keeping the column
+#      defaults, identity and generated columns but none of the indexes or constraints
+#   2. the upload loads into the staging table as usual (checkpointed, so --resume picks up
+#      the same staging table)
+#   3. swap(): builds the target's indexes and constraints on the staging table in one go,
+#      copies its grants and row level security policies, analyzes it and SET LOGGED, then
+#      in a single transaction drops the target and renames the staging table (and its indexes
+#      and constraints) into place. Readers see the old table until that commit and the new
+#      one right after, never a half-loaded one.
+# The table ends up holding exactly the loaded rows. Triggers, comments and foreign keys from
+# other tables pointing at the target are not carried over (the latter make the drop fail,
+# which leaves the target as it was).
+class StagingTable:
+    def __init__(self, table_name, db_config=None):
+        self.table_name = table_name
+        self.name = f"{table_name}_staging"
+        self.db_config = db_config or db_config_from_env()
+
+    # Function to run statements in one transaction, returning the rows of the last one
+    def run(self, *statements):
+        conn = create_connection(self.db_config)
+        try:
+            cur = conn.cursor()
+            try:
+                for statement in statements:
+                    if isinstance(statement, tuple):
+                        cur.execute(*statement)
+                    else:
+                        cur.execute(statement)
+                rows = cur.fetchall() if cur.description else None
+            finally:
+                cur.close()
+            conn.commit()
+            return rows
+        finally:
+            conn.close()
+
+    def exists(self):
+        return self.run(("SELECT to_regclass(%s) IS NOT NULL", (self.name,)))[0][0]
+
+    # Function to create an empty staging table, or keep the one a resumed load was writing to
+    def create(self, resume=False):
+        if resume:
+            if not self.exists():
+                raise ValueError(f"There is no staging table {self.name} to resume into; run without --resume to reload the file")
+            logging.info(f"Resuming the load into staging table {self.name}")
+            print(f"Resuming the load into staging table {self.name}")
+            return
+        self.run(f"DROP TABLE IF EXISTS {self.name}",
+                 f"CREATE UNLOGGED TABLE {self.name} (LIKE {self.table_name} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING GENERATED)")
+        logging.info(f"Loading into unlogged staging table {self.name}")
+        print(f"Loading into unlogged staging table {self.name}")
+
+    # Function to read the target's indexes (other than those backing constraints) and its
+    # constraints (NOT NULL is already copied by LIKE)
+    def target_definition(self):
+        indexes = self.run(("""
+            SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+            WHERE x.indrelid = %s::regclass AND NOT EXISTS (
+                SELECT 1 FROM pg_constraint c WHERE c.conrelid = x.indrelid AND c.conindid = x.indexrelid)""",
+                            (self.table_name,)))
+        constraints = self.run(("""
+            SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'c', 'f', 'x') ORDER BY contype = 'f', conname""",
+                                (self.table_name,)))
+        return indexes, constraints
+
+    # Function to get the statements that copy the target's grants and row level security
+    # policies to the staging table
+    def access_statements(self):
+        statements = []
+        for grantee, privilege in self.run(("""
+                SELECT CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(a.grantee)) END, a.privilege_type
+                FROM pg_class c, aclexplode(c.relacl) a WHERE c.oid = %s::regclass""", (self.table_name,))):
+            statements.append(f"GRANT {privilege} ON {self.name} TO {grantee}")
+        row_security, forced = self.run(("SELECT relrowsecurity, relforcerowsecurity FROM pg_class WHERE oid = %s::regclass",
+                                         (self.table_name,)))[0]
+        if row_security:
+            statements.append(f"ALTER TABLE {self.name} ENABLE ROW LEVEL SECURITY")
+        if forced:
+            statements.append(f"ALTER TABLE {self.name} FORCE ROW LEVEL SECURITY")
+        for name, permissive, command, roles, qual, with_check in self.run(("""
+                SELECT policyname, permissive, cmd,
+                       array_to_string(ARRAY(SELECT CASE WHEN r = 'public' THEN 'PUBLIC' ELSE quote_ident(r) END FROM unnest(roles) r), ', '),
+                       qual, with_check
+                FROM pg_policies WHERE format('%%I.%%I', schemaname, tablename)::regclass = %s::regclass""", (self.table_name,))):
+            policy = f"CREATE POLICY {quote_identifier(name)} ON {self.name} AS {permissive} FOR {command} TO {roles}"
+            if qual:
+                policy += f" USING ({qual})"
+            if with_check:
+                policy += f" WITH CHECK ({with_check})"
+            statements += [f"DROP POLICY IF EXISTS {quote_identifier(name)} ON {self.name}", policy]
+        return statements
+
+    # Function to build the indexes and constraints, make the staging table logged and swap it
+    # in for the target. Indexes and constraints already built by an earlier attempt are kept.
+    def swap(self):
+        start_time = time.time()
+        indexes, constraints = self.target_definition()
+        built = {name for name, in self.run(("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass", (self.name,)))}
+        renames = []
+        for name, definition in indexes:
+            match = INDEX_DEF_PATTERN.match(definition)
+            if match is None:
+                raise ValueError(f"Can't rebuild index {name} from its definition: {definition}")
+            temporary = staging_name(name)
+            logging.info(f"Building index {name} on {self.name}")
+            print(f"Building index {name} on {self.name}")
+            self.run(f"{match.group(1)}IF NOT EXISTS {quote_identifier(temporary)}{match.group(2)}{self.name}{match.group(3)}")
+            renames.append(f"ALTER INDEX {quote_identifier(temporary)} RENAME TO {quote_identifier(name)}")
+        for name, definition in constraints:
+            temporary = staging_name(name)
+            renames.append(f"ALTER TABLE {self.table_name} RENAME CONSTRAINT {quote_identifier(temporary)} TO {quote_identifier(name)}")
+            if temporary in built:
+                continue
+            logging.info(f"Adding constraint {name} on {self.name}")
+            print(f"Adding constraint {name} on {self.name}")
+            self.run(f"ALTER TABLE {self.name} ADD CONSTRAINT {quote_identifier(temporary)} {definition}")
+        self.run(*self.access_statements())
+        self.run(f"ANALYZE {self.name}")
+        logging.info(f"Setting {self.name} to logged")
+        print(f"Setting {self.name} to logged")
+        self.run(f"ALTER TABLE {self.name} SET LOGGED")
+
+        # Serial sequences are owned by the target's columns and would be dropped with it
+        # (identity columns get their own sequence from LIKE ... INCLUDING IDENTITY)
+        columns = self.run(("""
+            SELECT attname, pg_get_serial_sequence(%s, attname), attidentity <> '' FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped""", (self.table_name, self.table_name)))
+        reown = [f"ALTER SEQUENCE {sequence} OWNED BY {self.name}.{quote_identifier(column)}"
+                 for column, sequence, identity in columns if sequence and not identity]
+        self.run(f"LOCK TABLE {self.table_name} IN ACCESS EXCLUSIVE MODE",
+                 *reown,
+                 f"DROP TABLE {self.table_name}",
+                 f"ALTER TABLE {self.name} RENAME TO {self.table_name.split('.')[-1]}",
+                 *renames,
+                 *[(f"SELECT setval(pg_get_serial_sequence(%s, %s), max({quote_identifier(column)})) FROM {self.table_name} "
+                    f"HAVING max({quote_identifier(column)}) IS NOT NULL", (self.table_name, column))
+                   for column, sequence, _ in columns if sequence])
+        logging.info(f"Swapped {self.name} in as {self.table_name} in {time.time() - start_time:.2f} seconds")
+        print(f"Swapped {self.name} in as {self.table_name} in {time.time() - start_time:.2f} seconds")
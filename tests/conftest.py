@@ -0,0 +1,43 @@
+import io
+import os
+import sys
+import csv
+import random
+import pytest
+
+# The modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PIECES = ['a', 'b', 'caf\xe9', ' ', ',', '"', '""', '\n', '\r\n', '\r', '1', '-', '\t']
+
+# Function to parse CSV bytes the way csv.reader reads a file
+def parse_csv_bytes(data):
+    return list(csv.reader(io.StringIO(data.decode('ISO-8859-1'), newline='')))
+
+# Function to quote a CSV value when it needs it (or at random), doubling its quotes
+def csv_value(value, rng):
+    if any(c in value for c in ',"\r\n') or rng.random() < 0.2:
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+# Function to write a random CSV file whose values have embedded newlines (LF, CRLF and CR),
+# commas and quotes. Returns its bytes and its data rows as csv.reader reads them back.
+def write_random_csv(path, seed, rows=300, line_terminator='\n', trailing_newline=True):
+    rng = random.Random(seed)
+    records = ['id,name,text']
+    for i in range(rows):
+        values = [str(i)] + [''.join(rng.choice(PIECES) for _ in range(rng.randrange(6))) for _ in range(2)]
+        records.append(','.join(csv_value(value, rng) for value in values))
+    text = line_terminator.join(records) + (line_terminator if trailing_newline else '')
+    data = text.encode('ISO-8859-1')
+    with open(path, 'wb') as f:
+        f.write(data)
+    return data, parse_csv_bytes(data)[1:]
+
+@pytest.fixture
+def random_csv():
+    return write_random_csv
+
+@pytest.fixture
+def parse_csv():
+    return parse_csv_bytes
@@ -0,0 +1,62 @@
+import os
+import time
+import threading
+import pytest
+from engines import Engine
+from upload import upload_csv
+from checkpoint import default_checkpoint_path
+
+# Engine that records the id (first value) of every row it inserts. The batch starting after
+# fail_after_row fails with an error that isn't retried, once the batches sent after it have
+# had time to commit, like a run that dies while later batches are in flight.
+class RecordingEngine(Engine):
+    name = 'recording'
+
+    def __init__(self, columns, inserted, fail_after_row=None):
+        super().__init__('t', columns)
+        self.inserted = inserted
+        self.fail_after_row = fail_after_row
+        self.lock = threading.Lock()
+
+    def insert(self, batch, before_commit=None):
+        if self.fail_after_row is not None and int(batch[0][0]) == self.fail_after_row + 1:
+            time.sleep(0.2)
+            raise RuntimeError("lost the connection")
+        with self.lock:
+            self.inserted.extend(int(row[0]) for row in batch)
+
+def write_csv(path, rows):
+    with open(path, 'w') as f:
+        f.write('id,name\n')
+        for i in range(1, rows + 1):
+            f.write(f'{i},"name\n{i}"\n')
+
+@pytest.mark.parametrize('parse_workers', [0, 2])
+def test_resume_after_concurrent_batches_committed_ahead(tmp_path, parse_workers):
+    csv_path = str(tmp_path / 'rows.csv')
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    write_csv(csv_path, 3000)
+    inserted = []
+
+    with pytest.raises(RuntimeError):
+        upload_csv(RecordingEngine(['id', 'name'], inserted, fail_after_row=300), csv_path, 't', batch_size=100,
+                   concurrency=4, checkpoint_path=checkpoint_path, retry_delay=0, parse_workers=parse_workers)
+    assert 700 in inserted and 350 not in inserted
+
+    upload_csv(RecordingEngine(['id', 'name'], inserted), csv_path, 't', batch_size=100, concurrency=4,
+               checkpoint_path=checkpoint_path, resume=True, retry_delay=0, parse_workers=parse_workers)
+    assert sorted(inserted) == list(range(1, 3001))
+
+def test_resume_without_checkpoint_starts_at_start_row(tmp_path):
+    csv_path = str(tmp_path / 'rows.csv')
+    write_csv(csv_path, 250)
+    inserted = []
+    upload_csv(RecordingEngine(['id', 'name'], inserted), csv_path, 't', batch_size=100, start_row=120,
+               checkpoint_path=str(tmp_path / 'checkpoint.json'), resume=True)
+    assert inserted == list(range(121, 251))
+
+def test_checkpoints_of_files_with_the_same_name_differ(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path / '..')
+    paths = {default_checkpoint_path('t', path) for path in ('../data/a.csv', './data/a.csv', '/data/a.csv', 'data/a.csv')}
+    assert len(paths) == 3
+    assert default_checkpoint_path('t', 'data/a.csv') == default_checkpoint_path('t', os.path.abspath('data/a.csv'))
@@ -0,0 +1,25 @@
+import pytest
+from connection_pool import ConnectionPool
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+
+    def close(self):
+        self.closed = 1
+
+def test_a_connection_whose_setup_fails_is_closed_and_frees_its_slot():
+    opened = []
+
+    def connect():
+        opened.append(FakeConnection())
+        return opened[-1]
+
+    def on_connect(conn):
+        raise RuntimeError('relation "t" does not exist')
+    pool = ConnectionPool(connect, max_size=1, on_connect=on_connect)
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            pool.get()
+    assert [conn.closed for conn in opened] == [1, 1, 1]
+    assert pool.size == 0
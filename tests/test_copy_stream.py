@@ -0,0 +1,57 @@
+import io
+import re
+import csv
+import random
+import pytest
+from copy_stream import TransformingCopyStream, parse_column_map
+
+COPY_TEXT_UNESCAPES = {'\\\\': '\\', '\\t': '\t', '\\n': '\n', '\\r': '\r'}
+
+# Function to read COPY text format back into rows, with \N as None
+def parse_copy_text(data):
+    rows = []
+    for line in data.decode('utf-8').split('\n')[:-1]:
+        rows.append([None if field == '\\N' else re.sub(r'\\[\\tnr]', lambda m: COPY_TEXT_UNESCAPES[m.group()], field)
+                     for field in line.split('\t')])
+    return rows
+
+PIECES = ['a', 'caf\xe9', '\xff', ',', '"', '\\', '\t', '\n', '\r\n', ' ', '\\N']
+
+# Function to build a random Latin-1 CSV file, returning its header, its data rows as
+# csv.reader reads them and its lines as they are streamed out of the file
+def random_csv(seed, rows=200):
+    rng = random.Random(seed)
+    out = io.StringIO(newline='')
+    writer = csv.writer(out, lineterminator='\r\n')
+    header = ['id', 'Review Title', 'text', 'extra']
+    writer.writerow(header)
+    for i in range(rows):
+        writer.writerow([str(i)] + [''.join(rng.choice(PIECES) for _ in range(rng.randrange(4))) for _ in range(3)])
+    data = out.getvalue().encode('ISO-8859-1')
+    lines = [line.decode('ISO-8859-1') for line in io.BytesIO(data)]
+    rows = list(csv.reader(io.StringIO(data.decode('ISO-8859-1'), newline='')))
+    return header, rows[1:], lines[1:]
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('read_size', [-1, 1, 100, 64 * 1024])
+def test_stream_turns_blanks_into_null_and_keeps_every_value(seed, read_size):
+    header, rows, lines = random_csv(seed)
+    stream = TransformingCopyStream(iter(lines), header, rows_per_chunk=7)
+    if read_size < 0:
+        data = stream.read()
+    else:
+        data = b''.join(iter(lambda: stream.read(read_size), b''))
+    assert stream.columns == header
+    assert parse_copy_text(data) == [[value or None for value in row] for row in rows]
+    assert stream.rows == len(rows)
+
+def test_stream_renames_and_drops_columns():
+    header, rows, lines = random_csv(0, rows=50)
+    column_map = parse_column_map(['Review Title=title'], ['extra'])
+    stream = TransformingCopyStream(iter(lines), header, column_map)
+    assert stream.columns == ['id', 'title', 'text']
+    assert parse_copy_text(stream.read()) == [[value or None for value in row[:3]] for row in rows]
+
+def test_stream_reencodes_latin1_as_utf8():
+    stream = TransformingCopyStream(iter(['caf\xe9,\xff\n']), ['a', 'b'])
+    assert stream.read() == 'caf\xe9\t\xff\n'.encode('utf-8')
@@ -0,0 +1,20 @@
+import pytest
+from row_offsets import RowOffsetIndex
+from csv_chunks import read_record_blocks
+
+CASES = [(seed, terminator, trailing) for seed in range(4) for terminator in ('\n', '\r\n') for trailing in (True, False)]
+
+@pytest.mark.parametrize('seed,line_terminator,trailing_newline', CASES)
+def test_record_blocks_match_csv_reader(tmp_path, random_csv, parse_csv, seed, line_terminator, trailing_newline):
+    path = str(tmp_path / 'rows.csv')
+    data, rows = random_csv(path, seed, line_terminator=line_terminator, trailing_newline=trailing_newline)
+    with RowOffsetIndex(path, cache_path=str(tmp_path / 'offsets.json')) as index:
+        data_start = index.data_start
+    with open(path, 'rb') as f:
+        blocks = list(read_record_blocks(f, data_start, block_size=97))
+    offset = data_start
+    for block_offset, block in blocks:
+        assert block_offset == offset
+        offset += len(block)
+    assert offset == len(data)
+    assert [row for _, block in blocks for row in parse_csv(block)] == rows
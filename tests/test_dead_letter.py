@@ -0,0 +1,123 @@
+import os
+import gzip
+import json
+import threading
+import pytest
+import psycopg2.errors
+import upload
+from engines import Engine
+from json_body import encode_json_rows, split_json_rows
+from dead_letter import DeadLetterQueue, load_dead_letters
+from upload import upload_csv
+
+# Engine that encodes batches like the supabase engine and keeps the ids it "inserts"
+class JsonRecordingEngine(Engine):
+    name = 'json_recording'
+    encode_rows = staticmethod(encode_json_rows)
+
+    def __init__(self, columns, inserted):
+        super().__init__('t', columns)
+        self.inserted = inserted
+        self.lock = threading.Lock()
+
+    def split_batch(self, batch, count):
+        return split_json_rows(batch, count)
+
+    def insert(self, batch, before_commit=None):
+        with self.lock:
+            self.inserted.extend(int(row['id']) for row in json.loads(batch))
+
+def test_encode_json_rows_rejects_a_row_of_the_wrong_width():
+    with pytest.raises(ValueError):
+        encode_json_rows(['id', 'name'], [['1', 'a'], ['2']])
+
+@pytest.mark.parametrize('parse_workers', [0, 2])
+def test_rows_of_the_wrong_width_are_dead_lettered(tmp_path, parse_workers):
+    csv_path = str(tmp_path / 'rows.csv')
+    dead_letter_path = str(tmp_path / 'dead_letters.jsonl')
+    with open(csv_path, 'w') as f:
+        f.write('id,name\n')
+        for i in range(1, 501):
+            f.write(f'{i},"n\n{i}",extra\n' if i in (7, 250) else f'{i}\n' if i == 400 else f'{i},n{i}\n')
+    inserted = []
+    upload_csv(JsonRecordingEngine(['id', 'name'], inserted), csv_path, 't', batch_size=100, concurrency=2,
+               dead_letter_path=dead_letter_path, parse_workers=parse_workers)
+    assert sorted(inserted) == [i for i in range(1, 501) if i not in (7, 250, 400)]
+    entries = load_dead_letters(dead_letter_path)
+    assert [(entry['row'], entry['values']) for entry in entries] == [(7, ['7', 'n\n7', 'extra']), (250, ['250', 'n\n250', 'extra']),
+                                                                      (400, ['400'])]
+
+def test_a_row_of_the_wrong_width_stops_an_upload_without_dead_letters(tmp_path):
+    csv_path = str(tmp_path / 'rows.csv')
+    with open(csv_path, 'w') as f:
+        f.write('id,name\n1,a\n2\n3,c\n')
+    with pytest.raises(ValueError):
+        upload_csv(JsonRecordingEngine(['id', 'name'], []), csv_path, 't')
+
+# Engine that rejects the rows whose id is in bad_ids, like a constraint violation
+class RejectingEngine(JsonRecordingEngine):
+    def __init__(self, columns, inserted, bad_ids):
+        super().__init__(columns, inserted)
+        self.bad_ids = bad_ids
+
+    def insert(self, batch, before_commit=None):
+        if any(int(row['id']) in self.bad_ids for row in json.loads(batch)):
+            raise ValueError("violates check constraint")
+        super().insert(batch, before_commit)
+
+    def is_row_error(self, error):
+        return isinstance(error, ValueError)
+
+@pytest.mark.parametrize('parse_workers', [0, 2])
+def test_dead_letters_of_a_compressed_file_keep_the_records_read(tmp_path, monkeypatch, parse_workers):
+    csv_path = str(tmp_path / 'rows.csv.gz')
+    dead_letter_path = str(tmp_path / 'dead_letters.jsonl')
+    records = {i: f'{i},"n\n{i}",extra\n' if i == 30 else f'{i},"caf\xe9 {i}"\n' for i in range(1, 301)}
+    with gzip.open(csv_path, 'wb') as f:
+        f.write(b'id,name\n' + ''.join(records.values()).encode('ISO-8859-1'))
+
+    # Decompressing the file again for a dead-lettered row is what this avoids
+    def read_back(*args):
+        raise AssertionError("record read back from the compressed file")
+    monkeypatch.setattr(DeadLetterQueue, 'record', read_back)
+    inserted = []
+    upload_csv(RejectingEngine(['id', 'name'], inserted, {7, 150, 299}), csv_path, 't', batch_size=50, concurrency=2,
+               dead_letter_path=dead_letter_path, parse_workers=parse_workers)
+    assert len(inserted) == 296
+    assert {entry['row']: entry['record'] for entry in load_dead_letters(dead_letter_path)} == {
+        row: records[row] for row in (7, 30, 150, 299)}
+
+# Engine whose table doesn't exist, which fails every batch whatever its rows
+class MissingTableEngine(JsonRecordingEngine):
+    def __init__(self, columns, inserted):
+        super().__init__(columns, inserted)
+        self.calls = 0
+
+    def insert(self, batch, before_commit=None):
+        with self.lock:
+            self.calls += 1
+        raise psycopg2.errors.UndefinedTable('relation "t" does not exist')
+
+    def is_row_error(self, error):
+        return isinstance(error, (psycopg2.DataError, psycopg2.IntegrityError))
+
+def test_a_missing_table_stops_the_upload_instead_of_dead_lettering_every_row(tmp_path):
+    csv_path = str(tmp_path / 'rows.csv')
+    dead_letter_path = str(tmp_path / 'dead_letters.jsonl')
+    with open(csv_path, 'w') as f:
+        f.write('id,name\n' + ''.join(f'{i},n{i}\n' for i in range(1, 1001)))
+    engine = MissingTableEngine(['id', 'name'], [])
+    with pytest.raises(psycopg2.errors.UndefinedTable):
+        upload_csv(engine, csv_path, 't', batch_size=100, concurrency=2, dead_letter_path=dead_letter_path)
+    assert engine.calls <= 3
+    assert not os.path.exists(dead_letter_path)
+
+def test_the_upload_exits_with_status_1_when_rows_were_dead_lettered(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open('rows.csv', 'w') as f:
+        f.write('id,name\n' + ''.join(f'{i},n{i}\n' for i in range(1, 101)))
+    inserted = []
+    monkeypatch.setitem(upload.ENGINES, 'rejecting', lambda table, columns: RejectingEngine(columns, inserted, {42}))
+    assert upload.main(['--engine', 'rejecting', '--csv', 'rows.csv', '--table', 't', '--batch-size', '10']) == 1
+    assert len(inserted) == 99
+    assert [entry['row'] for entry in load_dead_letters('t_dead_letters.jsonl')] == [42]
@@ -0,0 +1,104 @@
+import json
+import time
+import threading
+import httpx
+import pytest
+import psycopg2
+import psycopg2.errors
+from engines import ExecuteValuesEngine, SupabaseEngine, PostgrestHTTPError
+from upload import upload_csv, parse_args
+
+def postgrest_error(status, body):
+    return PostgrestHTTPError(httpx.Response(status, json=body))
+
+def test_postgres_timeout_is_a_canceled_statement_only():
+    engine = ExecuteValuesEngine('t', ['id'], db_config={})
+    assert engine.is_timeout(psycopg2.errors.QueryCanceled("canceling statement due to statement timeout"))
+    assert not engine.is_timeout(psycopg2.OperationalError("timeout expired"))
+    assert not engine.is_timeout(psycopg2.errors.CheckViolation("row 413 timed out"))
+
+def test_postgrest_timeout_is_a_413_a_57014_or_a_read_timeout():
+    engine = SupabaseEngine('t', ['id'], 'http://postgrest', 'key')
+    try:
+        assert engine.is_timeout(postgrest_error(413, {'message': 'Payload Too Large'}))
+        assert engine.is_timeout(postgrest_error(500, {'code': '57014', 'message': 'canceling statement due to statement timeout'}))
+        assert engine.is_timeout(httpx.ReadTimeout("timed out"))
+        assert not engine.is_timeout(httpx.ConnectTimeout("timed out"))
+        assert not engine.is_timeout(postgrest_error(400, {'code': '22P02', 'message': 'invalid input syntax for type bigint: "413"'}))
+        assert not engine.is_timeout(postgrest_error(502, {'message': 'upstream request timeout'}))
+    finally:
+        engine.close()
+
+def test_postgres_row_errors_are_data_errors_and_constraint_violations():
+    engine = ExecuteValuesEngine('t', ['id'], db_config={})
+    assert engine.is_row_error(psycopg2.errors.InvalidTextRepresentation('invalid input syntax for type bigint: "x"'))
+    assert engine.is_row_error(psycopg2.errors.UniqueViolation('duplicate key value violates unique constraint'))
+    assert engine.is_row_error(psycopg2.errors.NotNullViolation('null value in column "id"'))
+    assert not engine.is_row_error(psycopg2.errors.UndefinedTable('relation "t" does not exist'))
+    assert not engine.is_row_error(psycopg2.errors.UndefinedColumn('column "nme" of relation "t" does not exist'))
+    assert not engine.is_row_error(psycopg2.errors.InsufficientPrivilege('permission denied for table t'))
+
+def test_postgrest_row_errors_carry_a_class_22_or_23_code():
+    engine = SupabaseEngine('t', ['id'], 'http://postgrest', 'key')
+    try:
+        assert engine.is_row_error(postgrest_error(400, {'code': '22P02', 'message': 'invalid input syntax for type bigint'}))
+        assert engine.is_row_error(postgrest_error(409, {'code': '23505', 'message': 'duplicate key value'}))
+        assert not engine.is_row_error(postgrest_error(404, {'code': '42P01', 'message': 'relation "t" does not exist'}))
+        assert not engine.is_row_error(postgrest_error(400, {'code': 'PGRST204', 'message': 'Could not find the column'}))
+        assert not engine.is_row_error(postgrest_error(401, {'code': '22000', 'message': 'JWT expired'}))
+        assert not engine.is_row_error(postgrest_error(403, {'code': '42501', 'message': 'permission denied for table t'}))
+    finally:
+        engine.close()
+
+def test_supabase_engine_adds_prefer_options_and_extra_headers():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(201)
+    engine = SupabaseEngine('t', ['id', 'name'], 'http://postgrest', 'key', timeout=5, connect_timeout=2,
+                            headers={'Prefer': 'missing=default', 'X-Gateway-Token': 'abc'}, transport=httpx.MockTransport(handler))
+    try:
+        engine.insert(engine.prepare([['1', 'a']]))
+        assert (engine.session.timeout.read, engine.session.timeout.connect) == (5, 2)
+    finally:
+        engine.close()
+    (request,) = requests
+    assert request.url.path == '/rest/v1/t'
+    assert request.headers['Prefer'] == 'return=minimal,missing=default'
+    assert request.headers['X-Gateway-Token'] == 'abc'
+    assert request.headers['apikey'] == 'key'
+    assert json.loads(request.content) == [{'id': '1', 'name': 'a'}]
+
+def test_supabase_engine_rejects_prefer_options_that_replace_its_own():
+    with pytest.raises(ValueError):
+        SupabaseEngine('t', ['id'], 'http://postgrest', 'key', headers={'Prefer': 'return=representation'})
+    with pytest.raises(ValueError):
+        SupabaseEngine('t', ['id'], 'http://postgrest', 'key', upsert_key=['id'], headers={'Prefer': 'resolution=ignore-duplicates'})
+    with pytest.raises(SystemExit):
+        parse_args(['--csv', 'rows.csv', '--table', 't', '--header', 'Prefer: return=representation'])
+
+def test_supabase_requests_overlap_under_concurrency(tmp_path):
+    lock = threading.Lock()
+    active = [0, 0]  # in flight now, most in flight at once
+    received = []
+
+    def handler(request):
+        with lock:
+            active[0] += 1
+            active[1] = max(active)
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+            received.extend(int(row['id']) for row in json.loads(request.content))
+        return httpx.Response(201)
+    csv_path = str(tmp_path / 'rows.csv')
+    with open(csv_path, 'w') as f:
+        f.write('id,name\n' + ''.join(f'{i},n{i}\n' for i in range(1, 401)))
+    engine = SupabaseEngine('t', ['id', 'name'], 'http://postgrest', 'key', transport=httpx.MockTransport(handler))
+    try:
+        upload_csv(engine, csv_path, 't', batch_size=50, concurrency=4)
+    finally:
+        engine.close()
+    assert sorted(received) == list(range(1, 401))
+    assert active[1] > 1
@@ -0,0 +1,106 @@
+import json
+import psycopg2
+import parallel_copy
+from parallel_copy import upload_csv_using_parallel_copy
+
+# Stand-in for the server: keeps the rows of every committed COPY, and fails connects and
+# commits as scripted. A commit failure either happens after the commit went through (the
+# connection is lost on the way back) or before it.
+class FakeDatabase:
+    def __init__(self, failing_connects=(), failing_commits=()):
+        self.failing_connects = list(failing_connects)
+        self.failing_commits = list(failing_commits)
+        self.rows = []
+        self.committed = set()
+        self.last_txid = 100
+        self.connects = 0
+
+    def connect(self, db_config):
+        self.connects += 1
+        if self.failing_connects and self.failing_connects.pop(0):
+            raise psycopg2.OperationalError("the database system is starting up")
+        return FakeConnection(self)
+
+class FakeConnection:
+    def __init__(self, database):
+        self.database = database
+        self.data = None
+        self.txid = None
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        database = self.database
+        failure = database.failing_commits.pop(0) if database.failing_commits else None
+        if failure != 'before':
+            database.rows.extend(self.data.decode().splitlines())
+            database.committed.add(self.txid)
+        if failure is not None:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = None
+
+    def execute(self, sql, params=None):
+        database = self.conn.database
+        if sql.startswith("SELECT txid_current()"):
+            database.last_txid += 1
+            self.conn.txid = database.last_txid
+            self.result = (self.conn.txid,)
+        elif sql.startswith("SELECT txid_status"):
+            self.result = ('committed' if params[0] in database.committed else 'aborted',)
+
+    def fetchone(self):
+        return self.result
+
+    def copy_expert(self, sql, stream, size=8192):
+        self.conn.data = stream.read()
+
+    def close(self):
+        pass
+
+def write_csv(tmp_path):
+    csv_path = str(tmp_path / 'rows.csv')
+    with open(csv_path, 'w') as f:
+        f.write('id,name\n' + ''.join(f'{i},n{i}\n' for i in range(1, 101)))
+    return csv_path
+
+def load(csv_path, failed_chunks_path, retry_failed=False):
+    return upload_csv_using_parallel_copy(csv_path, 't', parallel=1, num_chunks=1, failed_chunks_path=failed_chunks_path,
+                                          retry_failed=retry_failed, max_retries=2, retry_delay=0, db_config={})
+
+def test_a_chunk_committed_before_a_lost_connection_is_not_copied_again(tmp_path, monkeypatch):
+    database = FakeDatabase(failing_connects=[False, True], failing_commits=['after'])
+    monkeypatch.setattr(parallel_copy, 'create_connection', database.connect)
+    csv_path = write_csv(tmp_path)
+    assert load(csv_path, str(tmp_path / 'failed.json'))
+    assert len(database.rows) == 100
+    assert database.connects == 3
+
+def test_a_chunk_whose_commit_failed_is_copied_again(tmp_path, monkeypatch):
+    database = FakeDatabase(failing_commits=['before'])
+    monkeypatch.setattr(parallel_copy, 'create_connection', database.connect)
+    csv_path = write_csv(tmp_path)
+    assert load(csv_path, str(tmp_path / 'failed.json'))
+    assert len(database.rows) == 100
+
+def test_an_unconfirmed_commit_is_checked_by_the_retry_run(tmp_path, monkeypatch):
+    database = FakeDatabase(failing_connects=[False, True, True], failing_commits=['after'])
+    monkeypatch.setattr(parallel_copy, 'create_connection', database.connect)
+    csv_path = write_csv(tmp_path)
+    failed_chunks_path = str(tmp_path / 'failed.json')
+    assert not load(csv_path, failed_chunks_path)
+    with open(failed_chunks_path) as f:
+        (chunk,) = json.load(f)
+    assert chunk[2] == 101
+    assert load(csv_path, failed_chunks_path, retry_failed=True)
+    assert len(database.rows) == 100
@@ -0,0 +1,12 @@
+import pytest
+from row_batch import RowBatch
+
+def test_from_rows_keeps_values_in_their_columns():
+    batch = RowBatch.from_rows(['a', 'b', 'c'], [['1', '', '3'], ['4', '5', '6'], ['7', '8', '9']])
+    assert list(batch.rows()) == [['1', None, '3'], ['4', '5', '6'], ['7', '8', '9']]
+    assert list(batch[1:].rows()) == [['4', '5', '6'], ['7', '8', '9']]
+
+@pytest.mark.parametrize('row', [['4', '5'], ['4', '5', '6', '7']])
+def test_from_rows_rejects_a_row_of_the_wrong_width(row):
+    with pytest.raises(ValueError):
+        RowBatch.from_rows(['a', 'b', 'c'], [['1', '2', '3'], row, ['7', '8', '9']])
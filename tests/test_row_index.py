@@ -0,0 +1,79 @@
+import threading
+from engines import Engine
+from row_index import RowIndex
+from dead_letter import load_dead_letters
+from upload import upload_csv
+
+def entries(rows, first_row=1):
+    return [(i, row, 0, 0, None) for i, row in enumerate(rows, start=first_row)]
+
+def filter_rows(index, rows, first_row=1):
+    rejected = []
+    kept = index.filter(entries(rows, first_row), lambda entry, first: rejected.append((entry[0], first)))
+    return [entry[0] for entry in kept], rejected
+
+def test_new_changed_unchanged_and_duplicate_rows(tmp_path):
+    path = str(tmp_path / 'index.sqlite')
+    index = RowIndex(path, key_indices=[0])
+    index.start_file('a.csv')
+    assert filter_rows(index, [['1', 'a'], ['2', 'b'], ['3', 'c']]) == ([1, 2, 3], [])
+    index.commit(0, 3)
+    index.close()
+
+    index = RowIndex(path, key_indices=[0])
+    index.start_file('b.csv')
+    kept, rejected = filter_rows(index, [['1', 'a'], ['2', 'B'], ['4', 'd'], ['4', 'd'], ['2', 'b']])
+    assert kept == [2, 3]
+    assert rejected == [(5, 2)]
+    assert (index.new, index.changed, index.unchanged, index.duplicates, index.conflicts) == (1, 1, 1, 1, 1)
+    index.close()
+
+def test_the_first_row_with_a_key_wins_whether_or_not_it_committed(tmp_path):
+    index = RowIndex(str(tmp_path / 'index.sqlite'), key_indices=[0])
+    index.start_file('a.csv')
+    assert filter_rows(index, [['1', 'a']]) == ([1], [])
+    assert filter_rows(index, [['1', 'b']], first_row=2) == ([], [(2, 1)])
+    index.commit(0, 1)
+    assert filter_rows(index, [['1', 'c']], first_row=3) == ([], [(3, 1)])
+    index.close()
+
+def test_a_resumed_file_keeps_the_keys_of_its_earlier_rows(tmp_path):
+    path = str(tmp_path / 'index.sqlite')
+    index = RowIndex(path, key_indices=[0])
+    index.start_file('a.csv')
+    filter_rows(index, [['1', 'a'], ['2', 'b']])
+    index.commit(0, 1)
+    index.close()
+
+    index = RowIndex(path, key_indices=[0])
+    index.start_file('a.csv', resume=True)
+    assert filter_rows(index, [['2', 'b'], ['1', 'x']], first_row=2) == ([2], [(3, 1)])
+    index.start_file('a.csv')
+    assert filter_rows(index, [['1', 'x']], first_row=3) == ([3], [])
+    index.close()
+
+# Engine that keeps every (id, name) row it "inserts"
+class RecordingEngine(Engine):
+    name = 'recording'
+
+    def __init__(self, columns, inserted):
+        super().__init__('t', columns)
+        self.inserted = inserted
+        self.lock = threading.Lock()
+
+    def insert(self, batch, before_commit=None):
+        with self.lock:
+            self.inserted.extend(tuple(row) for row in batch)
+
+def test_a_later_row_with_an_earlier_key_is_dead_lettered(tmp_path):
+    csv_path = str(tmp_path / 'rows.csv')
+    dead_letter_path = str(tmp_path / 'dead_letters.jsonl')
+    with open(csv_path, 'w') as f:
+        f.write('id,name\n' + ''.join(f'{i},n{i}\n' for i in range(1, 1001)) + '5,n5\n7,changed\n')
+    inserted = []
+    index = RowIndex(str(tmp_path / 'index.sqlite'), key_indices=[0])
+    upload_csv(RecordingEngine(['id', 'name'], inserted), csv_path, 't', batch_size=50, concurrency=4,
+               dead_letter_path=dead_letter_path, row_index=index)
+    index.close()
+    assert sorted(inserted, key=lambda row: int(row[0])) == [(str(i), f'n{i}') for i in range(1, 1001)]
+    assert [(entry['row'], entry['values']) for entry in load_dead_letters(dead_letter_path)] == [(1002, ['7', 'changed'])]
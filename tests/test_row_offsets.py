@@ -0,0 +1,19 @@
+import pytest
+from row_offsets import RowOffsetIndex
+
+CASES = [(seed, terminator, trailing) for seed in range(4) for terminator in ('\n', '\r\n') for trailing in (True, False)]
+
+@pytest.mark.parametrize('seed,line_terminator,trailing_newline', CASES)
+def test_row_offsets_match_csv_reader(tmp_path, random_csv, parse_csv, seed, line_terminator, trailing_newline):
+    path = str(tmp_path / 'rows.csv')
+    data, rows = random_csv(path, seed, line_terminator=line_terminator, trailing_newline=trailing_newline)
+    with RowOffsetIndex(path, step=7, cache_path=str(tmp_path / 'offsets.json')) as index:
+        for n in range(len(rows) + 1):
+            assert parse_csv(data[index.offset_of_row(n):]) == rows[n:]
+    # The second index is loaded from the cache
+    with RowOffsetIndex(path, step=7, cache_path=str(tmp_path / 'offsets.json')) as index:
+        for num_chunks in (1, 2, 5, 16):
+            chunks = index.split(num_chunks)
+            assert chunks[0][0] == index.data_start and chunks[-1][1] == len(data)
+            assert all(end == start for (_, end), (start, _) in zip(chunks, chunks[1:]))
+            assert [row for start, end in chunks for row in parse_csv(data[start:end])] == rows
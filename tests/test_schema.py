@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from schema import infer_type
+
+def test_whole_numbers_are_bigint():
+    column_type, converter = infer_type(['1', '-42', ' 7 ', '0', ''])
+    assert column_type == 'bigint'
+    assert converter('-42') == -42
+
+def test_numbers_past_bigint_or_with_a_fraction_are_numeric():
+    assert infer_type(['1', '2.5', '1e3', '.5'])[0] == 'numeric'
+    assert infer_type(['9223372036854775808'])[0] == 'numeric'
+    assert infer_type(['0.25'])[1]('0.25') == Decimal('0.25')
+
+def test_booleans():
+    column_type, converter = infer_type(['true', 'F', 'yes', 'no'])
+    assert column_type == 'boolean'
+    assert converter('F') is False
+
+def test_timestamps():
+    column_type, converter = infer_type(['2024-05-29', '2024-06-04 13:45:00'])
+    assert column_type == 'timestamp'
+    assert converter('2024-06-04 13:45:00') == datetime(2024, 6, 4, 13, 45)
+    column_type, converter = infer_type(['5/29/2024', '12/31/2024'])
+    assert column_type == 'timestamp'
+    assert converter('5/29/2024') == datetime(2024, 5, 29)
+    assert infer_type(['2024-05-29T10:00:00+00:00', '2024-05-29'])[0] == 'timestamptz'
+    assert infer_type(['2024-05-29T10:00:00+00:00'])[1]('2024-05-29T10:00:00+00:00') == datetime(2024, 5, 29, 10, tzinfo=timezone.utc)
+
+def test_numbers_with_a_leading_zero_or_plus_stay_text():
+    assert infer_type(['02134', '90210']) == ('text', None)
+    assert infer_type(['000123']) == ('text', None)
+    assert infer_type(['+5', '6']) == ('text', None)
+    assert infer_type(['007.5', '1.5']) == ('text', None)
+    assert infer_type(['0', '10', '0.5'])[0] == 'numeric'
+
+def test_mixed_or_blank_columns_are_text():
+    assert infer_type(['1', 'abc']) == ('text', None)
+    assert infer_type(['', ' ']) == ('text', None)
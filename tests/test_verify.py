@@ -0,0 +1,28 @@
+import httpx
+import pytest
+from verify import SupabaseChecker
+
+# Function to build a PostgREST stand-in for the verification RPC that returns at most
+# max_rows rows per response, like db-max-rows, and the total only when asked for a count
+def paged_rpc(rows, max_rows, count=True, calls=None):
+    def handle(request):
+        params = request.url.params
+        assert params['order'] == 'bucket'
+        offset = int(params['offset'])
+        page = rows[offset:offset + min(int(params['limit']), max_rows)]
+        total = len(rows) if count and 'count=exact' in request.headers.get('Prefer', '') else '*'
+        if calls is not None:
+            calls.append(offset)
+        return httpx.Response(200, json=page, headers={'Content-Range': f"{offset}-{offset + len(page) - 1}/{total}"})
+    return handle
+
+@pytest.mark.parametrize('max_rows, count, expected_calls', [(1000, True, [0, 1000]), (300, True, [0, 300, 600, 900]),
+                                                             (300, False, [0, 300, 600, 900, 1024])])
+def test_buckets_are_read_past_the_max_rows_of_a_response(max_rows, count, expected_calls):
+    rows = [{'bucket': bucket, 'row_count': 1, 'checksum': bucket * 7} for bucket in range(1024)]
+    calls = []
+    checker = SupabaseChecker('t', 'http://postgrest', 'key')
+    checker.session = httpx.Client(base_url='http://postgrest/rest/v1',
+                                   transport=httpx.MockTransport(paged_rpc(rows, max_rows, count, calls)))
+    assert checker.buckets(1024) == {bucket: (1, bucket * 7) for bucket in range(1024)}
+    assert calls == expected_calls
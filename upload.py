@@ -0,0 +1,740 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from dotenv import load_dotenv
+from checkpoint import default_checkpoint_path, open_reader_at_start, mark_pending, mark_committed, row_already_committed
+from copy_stream import parse_column_map, column_selector
+from csv_chunks import read_header
+from engines import ENGINES, db_config_from_env
+from batch_sizing import AdaptiveBatchSizer
+from rate_limit import RateLimiter, backoff_delay
+from parse_pipeline import parse_batches_in_processes
+from dead_letter import DeadLetterQueue, default_dead_letter_path, load_dead_letters
+from parallel_copy import upload_csv_using_parallel_copy
+from metrics import UploadMetrics, MetricsWriter, RunProfiler
+from schema import infer_column_types, create_table_sql, create_table, TypedRowConverter
+from staging import StagingTable
+from row_index import RowIndex, default_row_index_path
+from input_files import STDIN, expand_inputs, is_compressed, open_input
+from verify import PostgresChecker, SupabaseChecker, verify_table
+
+# Inserts the batches of one upload through an engine, retrying only the batch that failed.
+# With a checkpoint every batch is recorded as pending before the commit (the PostgreSQL
+# engines pass their transaction id) and as committed afterwards; if a retry finds that the
+# previous attempt's transaction did commit, the batch is not sent again. Retries back off
+# exponentially from retry_delay with jitter, or wait as long as the server's Retry-After says
+# when it throttled us, in which case the limiter holds back every worker.
+# When row_positions (the file row number and start and end offset of every row, and for
+# compressed inputs the raw text of every record) is given, a
+# batch that times out is split in two and each half is inserted as its own batch, and the
+# sizer is told to shrink. With dead_letters, a batch that fails because of some of its rows
+# (a bad value, a constraint violation, see Engine.is_row_error) is bisected the same way until
+# the failing rows are isolated; those are written to the dead-letter file and the rest of the
+# batch is loaded. Any other error that isn't retried fails the batch.
+# With a row index (see row_index.RowIndex), the rows of every committed batch are recorded in
+# it, except for dead-lettered ones.
+class BatchInserter:
+    def __init__(self, engine, metrics, max_retries=3, retry_delay=1, max_retry_delay=60, checkpoint=None, checkpoint_path=None,
+                 sizer=None, limiter=None, dead_letters=None, row_index=None):
+        self.engine = engine
+        self.metrics = metrics
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.checkpoint = checkpoint
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_lock = threading.Lock()
+        self.sizer = sizer
+        self.limiter = limiter
+        self.dead_letters = dead_letters
+        self.row_index = row_index
+
+    # Function to insert a batch covering file rows start_row+1 .. end_row. Returns the time it took.
+    def insert(self, batch, start_row, end_row, end_offset, row_positions=None, batch_label="batch"):
+        engine = self.engine
+        start_time = time.time()
+        retry_count = 0
+        txids = []
+
+        def before_commit(txid):
+            txids.append(txid)
+            with self.checkpoint_lock:
+                mark_pending(self.checkpoint_path, self.checkpoint, start_row, end_row, end_offset, txid)
+
+        while True:
+            try:
+                if txids and engine.transaction_committed(txids[-1]):
+                    logging.info(f"The {batch_label} at row {start_row} was committed before the error, not retrying it")
+                    print(f"The {batch_label} at row {start_row} was committed before the error, not retrying it")
+                    break
+                if self.limiter is not None:
+                    throttle_start = time.perf_counter()
+                    self.limiter.acquire(end_row - start_row)
+                    self.metrics.record_stage('throttle', time.perf_counter() - throttle_start)
+                engine.insert(batch, before_commit if self.checkpoint is not None else None)
+                break
+            except Exception as e:
+                logging.error(f"Error inserting {batch_label} at row {start_row}: {e}")
+                print(f"Error inserting {batch_label} at row {start_row}: {e}")
+                splittable = row_positions is not None and len(row_positions[0]) > 1
+                if splittable and engine.is_timeout(e):
+                    self.metrics.record_retry()
+                    if self.sizer is not None:
+                        self.sizer.record_timeout()
+                    self.insert_halves(batch, start_row, end_row, end_offset, row_positions, batch_label)
+                    return time.time() - start_time
+                if not engine.is_retryable(e):
+                    if self.dead_letters is None or row_positions is None or not engine.is_row_error(e):
+                        raise
+                    if splittable:
+                        self.insert_halves(batch, start_row, end_row, end_offset, row_positions, batch_label)
+                        return time.time() - start_time
+                    record = row_positions[3][0] if len(row_positions) > 3 else None
+                    self.dead_letters.add(end_row, row_positions[1][0], row_positions[2][0], e, record)
+                    self.metrics.record_dead_letter()
+                    if self.row_index is not None:
+                        self.row_index.discard(end_row)
+                    break
+                retry_count += 1
+                if retry_count > self.max_retries:
+                    raise
+                self.metrics.record_retry()
+                wait = backoff_delay(retry_count, self.retry_delay, self.max_retry_delay)
+                throttled_for = engine.retry_after(e)
+                if throttled_for is not None:
+                    wait = throttled_for or wait
+                    if self.limiter is not None:
+                        self.limiter.pause(wait)
+                logging.info(f"Retrying {batch_label} at row {start_row} in {wait:.2f} seconds, attempt {retry_count}")
+                print(f"Retrying {batch_label} at row {start_row} in {wait:.2f} seconds, attempt {retry_count}")
+                time.sleep(wait)  # Wait before retrying
+                self.metrics.record_stage('backoff', wait)
+                engine.reset()
+
+        if self.checkpoint is not None:
+            with self.checkpoint_lock:
+                mark_committed(self.checkpoint_path, self.checkpoint, start_row, end_row, end_offset)
+        if self.row_index is not None:
+            self.row_index.commit(start_row, end_row)
+        return time.time() - start_time
+
+    # Function to insert a failed batch as two halves, each checkpointed on its own
+    def insert_halves(self, batch, start_row, end_row, end_offset, row_positions, batch_label):
+        row_numbers, row_ends = row_positions[0], row_positions[2]
+        count = len(row_numbers) // 2
+        logging.info(f"Splitting {batch_label} at row {start_row} into batches of {count} and {len(row_numbers) - count} rows")
+        print(f"Splitting {batch_label} at row {start_row} into batches of {count} and {len(row_numbers) - count} rows")
+        first, second = self.engine.split_batch(batch, count)
+        middle_row, middle_offset = row_numbers[count - 1], row_ends[count - 1]
+        self.insert(first, start_row, middle_row, middle_offset, tuple(item[:count] for item in row_positions), batch_label)
+        self.insert(second, middle_row, end_row, end_offset, tuple(item[count:] for item in row_positions), batch_label)
+
+# Function to upload a CSV file through an engine in batches. The reader thread parses rows,
+# applies the column selector and lets the engine prepare each batch, while up to
+# `concurrency` batches are being inserted by worker threads. The reader blocks while that
+# window is full and batches are reported in file order. With a checkpoint path every
+# committed batch is recorded, and resume=True seeks straight to the checkpointed offset.
+# With a sizer (see batch_sizing.AdaptiveBatchSizer) the batch size follows the observed
+# latency and payload size instead of staying at batch_size, and batches that time out are
+# split and retried as smaller ones. With a limiter (see rate_limit.RateLimiter) every request
+# waits for its share of the rows/sec and requests/sec budget. With parse_workers > 1 the
+# parsing and encoding move off the reader thread into that many worker processes. With a
+# dead-letter path, rows that fail on their own are written there instead of stopping the
+# upload (appended to when resuming). Time spent in each stage (see metrics.STAGES) is added
+# to `metrics`, and with a profiler the insert workers are profiled too. With a row index only
+# the rows that are new or changed since the rows it recorded are sent, and a row that repeats
+# an earlier row's key with different values is dead-lettered.
+def upload_csv(engine, csv_file_path, table_name, batch_size=500, start_row=0, concurrency=1, max_retries=3, retry_delay=1,
+               checkpoint_path=None, resume=False, select=None, sizer=None, limiter=None, max_retry_delay=60, parse_workers=0,
+               dead_letter_path=None, metrics=None, profiler=None, row_index=None, append_dead_letters=False):
+    own_metrics = metrics is None
+    if own_metrics:
+        metrics = UploadMetrics()
+    engine.stage_timer = metrics.record_stage
+    dead_letters = None
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    in_flight = deque()
+
+    # Wait for the oldest in-flight batch and report it
+    def report_oldest_batch():
+        end_row, row_count, batch_bytes, future = in_flight.popleft()
+        batch_time = future.result()
+        metrics.record_batch(row_count, batch_time, batch_bytes, end_row)
+        total_time = time.time() - metrics.start_time
+        logging.info(f"Inserted {end_row} rows in {batch_time:.2f} seconds. Total time: {total_time:.2f} seconds")
+        print(f"Inserted {end_row} rows in {batch_time:.2f} seconds. Total time: {total_time:.2f} seconds")
+        if sizer is not None:
+            previous_size = sizer.batch_size
+            sizer.record(row_count, batch_time, batch_bytes)
+            if sizer.batch_size != previous_size:
+                logging.info(f"Batch size changed from {previous_size} to {sizer.batch_size} rows")
+                print(f"Batch size changed from {previous_size} to {sizer.batch_size} rows")
+
+    # Function to get the size for the next batch
+    def current_batch_size():
+        return sizer.batch_size if sizer is not None else batch_size
+
+    # Submit a prepared batch covering file rows batch_start_row+1 .. batch_end_row once there
+    # is room in the window
+    def submit_batch(batch, row_count, batch_start_row, batch_end_row, batch_start_offset, batch_end_offset, row_positions,
+                     batch_label="batch"):
+        batch_bytes = engine.payload_size(batch, batch_end_offset - batch_start_offset)
+        wait_start = time.perf_counter()
+        while len(in_flight) >= concurrency:
+            report_oldest_batch()
+        metrics.record_stage('backpressure', time.perf_counter() - wait_start)
+        future = executor.submit(insert, batch, batch_start_row, batch_end_row, batch_end_offset, row_positions, batch_label)
+        in_flight.append((batch_end_row, row_count, batch_bytes, future))
+
+    if csv_file_path == STDIN and dead_letter_path:
+        # stdin can't be read back for the record of a bad row
+        logging.info("Not writing a dead-letter file for stdin; a row that fails on its own stops the upload")
+        print("Not writing a dead-letter file for stdin; a row that fails on its own stops the upload")
+        dead_letter_path = None
+
+    try:
+        with open_input(csv_file_path) as f:
+            engine.start(concurrency)
+            line_reader, reader, header, total_rows, checkpoint, committed_ahead = open_reader_at_start(
+                f, csv_file_path, table_name, start_row, checkpoint_path, resume, engine.transaction_committed)
+            skip_committed = bool(committed_ahead)
+            if dead_letter_path:
+                dead_letters = DeadLetterQueue(dead_letter_path, csv_file_path, header, append=resume or append_dead_letters)
+            inserter = BatchInserter(engine, metrics, max_retries, retry_delay, max_retry_delay, checkpoint, checkpoint_path,
+                                     sizer, limiter, dead_letters, row_index)
+            insert = profiler.wrap(inserter.insert) if profiler is not None else inserter.insert
+            track_rows = sizer is not None or dead_letters is not None
+            # A compressed file can't be read back by offset without decompressing it again up
+            # to the row, so the raw text of every record goes along with its batch instead
+            keep_records = dead_letters is not None and is_compressed(csv_file_path)
+            if parse_workers > 1 and skip_committed:
+                # Worker processes can't number rows before the blocks ahead of them are parsed,
+                # so they can't skip batches committed out of order
+                logging.info("Parsing on the reader thread to skip batches committed ahead of the checkpoint")
+                print("Parsing on the reader thread to skip batches committed ahead of the checkpoint")
+                parse_workers = 0
+            if row_index is not None:
+                row_index.start_file(csv_file_path, resume)
+            if parse_workers > 1 and row_index is not None:
+                logging.info("Parsing on the reader thread to check rows against the row index")
+                print("Parsing on the reader thread to check rows against the row index")
+                parse_workers = 0
+
+            # Function to dead-letter a row that doesn't have a value for every column of the
+            # header (or stop the upload without a dead-letter file); its values can't be matched
+            # to the columns
+            def reject_row(row_number, start_offset, end_offset, values, record=None):
+                error = ValueError(f"Row {row_number} has {values} values but the header has {len(header)} columns")
+                if dead_letters is None:
+                    raise error
+                dead_letters.add(row_number, start_offset, end_offset, error, record)
+                metrics.record_dead_letter(sent=False)
+
+            # Function to dead-letter a row whose key an earlier row of the file already used with
+            # different values (see row_index.RowIndex), or stop the upload without a dead-letter file
+            def reject_repeated_key(entry, first_row):
+                error = ValueError(f"Row {entry[0]} has the same key as row {first_row} but different values")
+                if dead_letters is None:
+                    raise error
+                dead_letters.add(entry[0], entry[2], entry[3], error, entry[4])
+                metrics.record_dead_letter(sent=False)
+
+            if parse_workers > 1:
+                for batch, batch_start_row, row_numbers, row_starts, row_ends, records in parse_batches_in_processes(
+                        f, line_reader.offset, total_rows, engine.encode_rows, engine.columns, select,
+                        current_batch_size, parse_workers, len(header), reject_row, keep_records=keep_records,
+                        record_stage=metrics.record_stage):
+                    row_positions = None
+                    if track_rows:
+                        row_positions = (row_numbers, row_starts, row_ends) + ((records,) if keep_records else ())
+                    submit_batch(batch, len(row_numbers), batch_start_row, row_numbers[-1], row_starts[0], row_ends[-1],
+                                 row_positions)
+                while in_flight:
+                    report_oldest_batch()
+                return metrics
+
+            # Function to map and encode the rows of a batch, timing both
+            def prepare_batch(rows):
+                mapped = time.perf_counter()
+                if select is not None:
+                    rows = [select(row) for row in rows]
+                encoded = time.perf_counter()
+                batch = engine.prepare(rows)
+                metrics.record_stage('transform', encoded - mapped)
+                metrics.record_stage('serialize', time.perf_counter() - encoded)
+                return batch
+
+            # Function to split the reader thread's time since the last batch into reading and parsing
+            def record_read_and_parse():
+                nonlocal parse_start, read_time
+                now = time.perf_counter()
+                metrics.record_stage('read', line_reader.read_time - read_time)
+                metrics.record_stage('parse', now - parse_start - (line_reader.read_time - read_time))
+                parse_start, read_time = now, line_reader.read_time
+
+            # Function to yield (row number, row, start offset, end offset, record text or None)
+            # for the rows to send, leaving out rows committed ahead of the checkpoint, rows of
+            # the wrong width and rows the row index already has (which are checked a chunk at a
+            # time)
+            def rows_to_send():
+                row_start = line_reader.offset
+                entries = []
+                record = None
+                if keep_records:
+                    line_reader.lines = []
+                for i, row in enumerate(reader, start=total_rows + 1):
+                    if keep_records:
+                        record = ''.join(line_reader.lines)
+                        line_reader.lines.clear()
+                    if skip_committed and row_already_committed(committed_ahead, i):
+                        pass
+                    elif len(row) != len(header):
+                        reject_row(i, row_start, line_reader.offset, len(row), record)
+                    else:
+                        entries.append((i, row, row_start, line_reader.offset, record))
+                    row_start = line_reader.offset
+                    if row_index is None:
+                        yield from entries
+                        entries = []
+                    elif len(entries) >= RowIndex.lookup_size:
+                        yield from row_index.filter(entries, reject_repeated_key)
+                        entries = []
+                if entries:
+                    yield from row_index.filter(entries, reject_repeated_key)
+
+            batch_size = current_batch_size()
+            rows = []
+            # Function to start the row positions of a new batch
+            def new_row_positions():
+                if not track_rows:
+                    return None
+                return (array('q'), array('q'), array('q')) + (([],) if keep_records else ())
+
+            row_positions = new_row_positions()
+            batch_start_row = total_rows
+            batch_start_offset = line_reader.offset
+            parse_start, read_time = time.perf_counter(), line_reader.read_time
+            for i, row, row_start, row_end, record in rows_to_send():
+                rows.append(row)
+                if row_positions is not None:
+                    row_positions[0].append(i)
+                    row_positions[1].append(row_start)
+                    row_positions[2].append(row_end)
+                    if keep_records:
+                        row_positions[3].append(record)
+                if len(rows) >= batch_size:
+                    record_read_and_parse()
+                    submit_batch(prepare_batch(rows), len(rows), batch_start_row, i, batch_start_offset, row_end, row_positions)
+                    batch_start_row = i
+                    batch_start_offset = row_end
+                    rows = []
+                    row_positions = new_row_positions()
+                    batch_size = current_batch_size()
+                    parse_start = time.perf_counter()
+
+            # Insert any remaining rows
+            record_read_and_parse()
+            if rows:
+                submit_batch(prepare_batch(rows), len(rows), batch_start_row, i, batch_start_offset, row_end,
+                             row_positions, batch_label="final batch")
+
+            while in_flight:
+                report_oldest_batch()
+        return metrics
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        if dead_letters is not None:
+            dead_letters.close()
+        if own_metrics:
+            metrics.finish()
+            logging.info(metrics.summary())
+            print(metrics.summary())
+
+# Function to load the rows of a dead-letter file again, e.g. after fixing the table or the
+# values in the file. The rows are sent in batches and bisected like a normal upload, one CSV
+# file at a time (row numbers are per file); rows that still fail are written back to the
+# dead-letter file, which is removed once every row went in.
+def replay_dead_letters(engine, dead_letter_path, batch_size=500, max_retries=3, retry_delay=1, select=None, max_retry_delay=60,
+                        metrics=None):
+    own_metrics = metrics is None
+    if own_metrics:
+        metrics = UploadMetrics()
+    engine.stage_timer = metrics.record_stage
+    entries = load_dead_letters(dead_letter_path)
+    logging.info(f"Replaying {len(entries)} rows from {dead_letter_path}")
+    print(f"Replaying {len(entries)} rows from {dead_letter_path}")
+
+    entries_by_file = {}
+    for entry in entries:
+        entries_by_file.setdefault(entry['csv_file'], []).append(entry)
+    retry_path = f"{dead_letter_path}.tmp"
+    failed = 0
+    engine.start(1)
+    try:
+        for n, (csv_file_path, file_entries) in enumerate(entries_by_file.items()):
+            records = {entry['row']: entry['record'] for entry in file_entries}
+            dead_letters = DeadLetterQueue(retry_path, csv_file_path, file_entries[0]['header'], append=n > 0, records=records)
+            inserter = BatchInserter(engine, metrics, max_retries, retry_delay, max_retry_delay, dead_letters=dead_letters)
+            try:
+                width = len(file_entries[0]['header'])
+                for entry in file_entries:
+                    if len(entry['values']) != width:
+                        dead_letters.add(entry['row'], entry['offset'], entry['end_offset'],
+                                         ValueError(f"Row {entry['row']} has {len(entry['values'])} values but the header has {width} columns"))
+                        metrics.record_dead_letter(sent=False)
+                file_entries = [entry for entry in file_entries if len(entry['values']) == width]
+                for i in range(0, len(file_entries), batch_size):
+                    batch_entries = file_entries[i:i + batch_size]
+                    rows = [entry['values'] if select is None else select(entry['values']) for entry in batch_entries]
+                    row_positions = (array('q', [entry['row'] for entry in batch_entries]),
+                                     array('q', [entry['offset'] for entry in batch_entries]),
+                                     array('q', [entry['end_offset'] for entry in batch_entries]))
+                    batch = engine.prepare(rows)
+                    batch_time = inserter.insert(batch, batch_entries[0]['row'] - 1, batch_entries[-1]['row'],
+                                                 batch_entries[-1]['end_offset'], row_positions)
+                    metrics.record_batch(len(rows), batch_time, engine.payload_size(batch, 0), batch_entries[-1]['row'])
+            finally:
+                dead_letters.close()
+            failed += dead_letters.count
+    finally:
+        if own_metrics:
+            metrics.finish()
+            logging.info(metrics.summary())
+            print(metrics.summary())
+    if failed:
+        os.replace(retry_path, dead_letter_path)
+    else:
+        os.remove(dead_letter_path)
+    return metrics
+
+# Function to check that the table holds exactly the rows of the CSV files, after or instead
+# of a load. Rows that are missing or differ go to the dead-letter file for --replay.
+def verify_upload(args, column_map, dead_letter_path):
+    header = read_header(args.csv[0])
+    columns, select = column_selector(header, column_map)
+    checker = SupabaseChecker(args.table) if args.engine == 'supabase' else PostgresChecker(args.table)
+    try:
+        return verify_table(checker, args.table, args.csv, columns, select, header, args.verify_buckets, dead_letter_path)
+    finally:
+        checker.close()
+
+# Function to parse the command line
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Upload a CSV file to PostgreSQL or Supabase')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='supabase', help='Loader engine to use')
+    parser.add_argument('--csv', type=str, nargs='+', help='CSV files, globs or directories to load; .gz and .zst files are decompressed as they are read, and - reads stdin')
+    parser.add_argument('--table', type=str, required=True, help='Name of the database table')
+    parser.add_argument('--batch-size', type=int, help='Rows per batch (default depends on the engine)')
+    parser.add_argument('--start-row', type=int, default=0, help='Number of data rows to skip before uploading')
+    parser.add_argument('--concurrency', type=int, default=1, help='Number of batches to keep in flight at once')
+    parser.add_argument('--parallel-files', type=int, default=1, help='Number of CSV files to load at once, each with its own --concurrency connections')
+    parser.add_argument('--max-retries', type=int, default=3, help='Retries per batch before giving up')
+    parser.add_argument('--retry-delay', type=float, default=1, help='Seconds to wait before the first retry, doubling on every further retry')
+    parser.add_argument('--max-retry-delay', type=float, default=60, help='Longest wait between retries')
+    parser.add_argument('--rows-per-second', type=float, help='Most rows to send per second across all connections')
+    parser.add_argument('--requests-per-second', type=float, help='Most batches to send per second across all connections')
+    parser.add_argument('--delay', type=float, default=0, help='Minimum seconds between batches (same as --requests-per-second 1/DELAY)')
+    parser.add_argument('--resume', action='store_true', help='Resume from the byte offset stored in the checkpoint file')
+    parser.add_argument('--checkpoint', type=str, help='Path to the checkpoint file')
+    parser.add_argument('--dead-letter', type=str, help='File for rows that fail on their own (default: <table>_dead_letters.jsonl)')
+    parser.add_argument('--fail-fast', action='store_true', help='Stop the upload at the first bad row instead of dead-lettering it')
+    parser.add_argument('--replay', action='store_true', help='Load the rows in the dead-letter file again instead of a CSV file')
+    parser.add_argument('--parse-workers', type=int, default=0, help='Parse and encode batches in this many worker processes instead of on the reader thread')
+    parser.add_argument('--adaptive', action='store_true', help='Grow or shrink the batch size toward --target-latency and --target-bytes')
+    parser.add_argument('--target-latency', type=float, default=2.0, help='Seconds per batch the adaptive batch size aims for')
+    parser.add_argument('--target-bytes', type=int, default=4 * 1024 * 1024, help='Payload bytes per batch the adaptive batch size stays under')
+    parser.add_argument('--min-batch-size', type=int, default=50, help='Smallest batch size the adaptive batch size will use')
+    parser.add_argument('--max-batch-size', type=int, default=50000, help='Largest batch size the adaptive batch size will use')
+    parser.add_argument('--map', action='append', metavar='CSV_COLUMN=TABLE_COLUMN', help='Load a CSV column into a differently named table column')
+    parser.add_argument('--drop', action='append', metavar='CSV_COLUMN', help='Leave a CSV column out of the load')
+    parser.add_argument('--infer-types', action='store_true', help='Infer column types from the first --sample-rows rows and send typed values')
+    parser.add_argument('--create-table', action='store_true', help='Create the table with the inferred column types if it does not exist (implies --infer-types)')
+    parser.add_argument('--sample-rows', type=int, default=1000, help='Rows to sample when inferring column types')
+    parser.add_argument('--key', action='append', metavar='TABLE_COLUMN', help='Column that identifies a row; rows with a key that is already in the table update it (needs a unique constraint on the key columns; --create-table makes them the primary key)')
+    parser.add_argument('--incremental', action='store_true', help='Only send rows that are new or changed since the last incremental load, as recorded in --row-index')
+    parser.add_argument('--row-index', type=str, help='Local index of the loaded rows for --incremental (default: <table>_row_index.sqlite)')
+    parser.add_argument('--reset-index', action='store_true', help='Forget the rows recorded in the row index, e.g. after the table was emptied')
+    parser.add_argument('--staging', action='store_true', help='Load into an unlogged staging table, then build its indexes and swap it in for the table (PostgreSQL engines; the table ends up with only the loaded rows)')
+    parser.add_argument('--verify', action='store_true', help='After the load, check the table against the CSV files by comparing row counts and checksums computed on the server')
+    parser.add_argument('--verify-only', action='store_true', help='Check the table against the CSV files without loading anything')
+    parser.add_argument('--verify-buckets', type=int, default=1024, help='Number of hash buckets the rows are compared in')
+    parser.add_argument('--metrics-file', type=str, help='Write per-batch and total metrics to this file')
+    parser.add_argument('--metrics-format', choices=['jsonl', 'prometheus'], default='jsonl', help='JSON lines, or Prometheus text rewritten as the upload runs')
+    parser.add_argument('--profile', type=str, metavar='PATH', help='Profile the upload with cProfile and write the stats to PATH')
+    parser.add_argument('--tracemalloc', action='store_true', help='Trace memory allocations and log the peak and the top allocating lines')
+
+    insert_group = parser.add_argument_group('INSERT engines (execute_batch and execute_values)')
+    insert_group.add_argument('--page-size', type=int, help='Rows per INSERT statement for execute_values (default: 1000)')
+    insert_group.add_argument('--on-conflict-do-nothing', action='store_true', help='Skip rows that violate a unique constraint instead of failing the batch')
+
+    supabase_group = parser.add_argument_group('supabase engine')
+    supabase_group.add_argument('--gzip', action='store_true', help='Gzip request bodies (needs a gateway that accepts Content-Encoding: gzip)')
+    supabase_group.add_argument('--http-timeout', type=float, help='Seconds to wait for a PostgREST response (default: 60)')
+    supabase_group.add_argument('--connect-timeout', type=float, help='Seconds to wait for a new connection (default: --http-timeout)')
+    supabase_group.add_argument('--header', action='append', metavar='"NAME: VALUE"',
+                                help="Extra request header; repeat for more. Prefer options are added to return=minimal and can't replace it")
+
+    copy_group = parser.add_argument_group('whole-file COPY (copy engine only)')
+    copy_group.add_argument('--parallel', type=int, help='COPY the file as byte-range chunks over this many connections instead of in batches')
+    copy_group.add_argument('--chunks', type=int, help='Number of byte-range chunks to split the file into (default: 4 per connection)')
+    copy_group.add_argument('--retry-failed', action='store_true', help='Only load the chunks recorded as failed by the previous parallel run')
+    copy_group.add_argument('--transform', action='store_true', help='Stream chunks through the NULL/UTF-8/column-mapping transform instead of sending the raw file')
+    args = parser.parse_args(argv)
+    if not args.csv and not args.replay:
+        parser.error("--csv is required unless --replay is given")
+    if args.csv:
+        try:
+            args.csv = expand_inputs(args.csv)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.parallel_files < 1:
+        parser.error("--parallel-files must be at least 1")
+    for header in args.header or []:
+        name, colon, value = header.partition(':')
+        if not colon:
+            parser.error(f"--header {header!r} isn't of the form \"NAME: VALUE\"")
+        if name.strip().lower() == 'prefer' and 'return=' in value:
+            parser.error("--header can't set Prefer: return=...; the engine always asks for return=minimal")
+    if args.csv and len(args.csv) > 1 and (args.start_row or args.checkpoint):
+        parser.error("--start-row and --checkpoint apply to a single CSV file; with several files each gets its own checkpoint")
+    if args.csv == [STDIN] and args.resume:
+        parser.error("stdin can't be resumed; save it to a file to load it with --resume")
+    if args.parallel_files > 1 and (args.key or args.incremental):
+        parser.error("--key and --incremental load the files in order so later files win; they can't be combined with --parallel-files")
+    if args.csv and args.engine == 'copy' and (args.parallel or args.retry_failed) and (len(args.csv) > 1 or is_compressed(args.csv[0])):
+        parser.error("a parallel COPY splits one uncompressed file into byte ranges; use the batched copy engine for several, compressed or piped files")
+    if args.replay and args.fail_fast:
+        parser.error("--replay always dead-letters the rows that still fail")
+    if args.page_size and args.engine != 'execute_values':
+        parser.error("--page-size only applies to --engine execute_values")
+    if args.on_conflict_do_nothing and args.engine not in ('execute_batch', 'execute_values'):
+        parser.error("--on-conflict-do-nothing only applies to --engine execute_batch or execute_values")
+    if (args.gzip or args.http_timeout or args.connect_timeout or args.header) and args.engine != 'supabase':
+        parser.error("--gzip, --http-timeout, --connect-timeout and --header only apply to --engine supabase")
+    if args.header and any(':' not in header for header in args.header):
+        parser.error('--header takes "NAME: VALUE"')
+    if args.replay and (args.infer_types or args.create_table):
+        parser.error("--infer-types and --create-table don't apply to --replay")
+    if args.infer_types and args.engine == 'copy' and (args.parallel or args.retry_failed):
+        parser.error("a parallel COPY sends the file as-is; use --create-table on its own to create a typed table")
+    if args.staging and args.engine == 'supabase':
+        parser.error("--staging needs a PostgreSQL engine; PostgREST can't create or rename tables")
+    if args.staging and args.replay:
+        parser.error("--staging reloads a whole file; --replay loads into the table directly")
+    if args.staging and args.on_conflict_do_nothing:
+        parser.error("the staging table has no unique indexes until the swap, so --on-conflict-do-nothing can't be used with --staging")
+    if args.key and args.on_conflict_do_nothing:
+        parser.error("--key updates conflicting rows; it can't be combined with --on-conflict-do-nothing")
+    if (args.key or args.incremental) and args.staging:
+        parser.error("--staging reloads the whole table; --key and --incremental load into it directly")
+    if (args.key or args.incremental) and args.engine == 'copy' and (args.parallel or args.retry_failed):
+        parser.error("--key and --incremental need the batched copy engine, not --parallel")
+    if (args.row_index or args.reset_index) and not args.incremental:
+        parser.error("--row-index and --reset-index only apply to --incremental")
+    if args.replay and args.incremental:
+        parser.error("--incremental doesn't apply to --replay")
+    if (args.verify or args.verify_only) and (args.replay or not args.csv):
+        parser.error("--verify and --verify-only check the table against the --csv files")
+    if (args.verify or args.verify_only) and args.csv == [STDIN]:
+        parser.error("stdin can't be read a second time to verify it")
+    if (args.verify or args.verify_only) and args.start_row:
+        parser.error("--verify compares the whole file with the table, so it can't be combined with --start-row")
+    if args.verify_buckets < 1:
+        parser.error("--verify-buckets must be at least 1")
+    if args.metrics_file and args.engine == 'copy' and (args.parallel or args.retry_failed):
+        parser.error("--metrics-file doesn't apply to a parallel COPY")
+    return args
+
+# Function to run an upload from command line arguments. Returns the process exit code.
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Load environment variables from .env file
+    load_dotenv()
+
+    # Set up logging
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    log_filename = f"{args.table}_{args.engine}_upload_log_{timestamp}.log"
+    logging.basicConfig(filename=log_filename, level=logging.INFO,
+                        format='%(asctime)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    # Log the start of the process
+    logging.info("Starting CSV upload process")
+    print("Starting CSV upload process")
+    dead_letter_path = args.dead_letter or default_dead_letter_path(args.table)
+    csv_files = ', '.join(args.csv) if args.csv else dead_letter_path
+    logging.info(f"CSV file path: {csv_files}")
+    logging.info(f"Table name: {args.table}")
+    logging.info(f"Engine: {args.engine}")
+    print(f"CSV file path: {csv_files}")
+    print(f"Table name: {args.table}")
+    print(f"Engine: {args.engine}")
+
+    column_map = parse_column_map(args.map, args.drop)
+    dead_letter_count = 0
+    try:
+        if args.verify_only:
+            return 0 if verify_upload(args, column_map, dead_letter_path) else 1
+
+        column_types = None
+        if args.infer_types or args.create_table:
+            columns, select = column_selector(read_header(args.csv[0]), column_map)
+            column_types = infer_column_types(args.csv[0], select, args.sample_rows)
+            sql = create_table_sql(args.table, columns, column_types, args.key)
+            logging.info(f"Inferred table: {sql}")
+            print(f"Inferred table: {sql}")
+            if args.create_table:
+                create_table(db_config_from_env(), sql)
+                logging.info(f"Created table {args.table} if it did not exist")
+                print(f"Created table {args.table} if it did not exist")
+
+        staging = None
+        load_table = args.table
+        if args.staging:
+            staging = StagingTable(args.table)
+            staging.create(resume=args.resume or args.retry_failed)
+            load_table = staging.name
+
+        if args.engine == 'copy' and (args.parallel or args.retry_failed) and not args.replay:
+            copy_column_map = column_map if args.transform or column_map else None
+            if not upload_csv_using_parallel_copy(args.csv[0], load_table, parallel=args.parallel or 1, num_chunks=args.chunks,
+                                                  failed_chunks_path=f"{args.table}_failed_chunks.json", retry_failed=args.retry_failed,
+                                                  column_map=copy_column_map, max_retries=args.max_retries, retry_delay=args.retry_delay,
+                                                  max_retry_delay=args.max_retry_delay):
+                return 1
+        else:
+            if args.replay:
+                entries = load_dead_letters(dead_letter_path)
+                if not entries:
+                    logging.info(f"No rows to replay in {dead_letter_path}")
+                    print(f"No rows to replay in {dead_letter_path}")
+                    return 0
+                header = entries[0]['header']
+            else:
+                header = read_header(args.csv[0])
+                for csv_file_path in args.csv[1:]:
+                    if read_header(csv_file_path) != header:
+                        raise ValueError(f"The header of {csv_file_path} doesn't match the header of {args.csv[0]}")
+            columns, select = column_selector(header, column_map)
+            missing = [column for column in args.key or [] if column not in columns]
+            if missing:
+                raise ValueError(f"Key columns {', '.join(missing)} are not among the loaded columns {', '.join(columns)}")
+            if column_types is not None:
+                select = TypedRowConverter(column_types, select)
+            engine_options = {}
+            if args.key:
+                engine_options['upsert_key'] = args.key
+            if args.page_size:
+                engine_options['page_size'] = args.page_size
+            if args.on_conflict_do_nothing:
+                engine_options['on_conflict_do_nothing'] = True
+            if args.gzip:
+                engine_options['gzip_body'] = True
+            if args.http_timeout:
+                engine_options['timeout'] = args.http_timeout
+            if args.connect_timeout:
+                engine_options['connect_timeout'] = args.connect_timeout
+            if args.header:
+                engine_options['headers'] = dict((name.strip(), value.strip()) for name, value in
+                                                 (header.split(':', 1) for header in args.header))
+            engine_class = ENGINES[args.engine]
+            batch_size = args.batch_size or engine_class.default_batch_size
+            requests_per_second = args.requests_per_second or (1 / args.delay if args.delay else None)
+            limiter = None
+            if args.rows_per_second or requests_per_second:
+                limiter = RateLimiter(args.rows_per_second, requests_per_second)
+            writer = None
+            if args.metrics_file:
+                writer = MetricsWriter(args.metrics_file, args.metrics_format, {'table': args.table, 'engine': args.engine})
+            metrics = UploadMetrics(writer)
+            profiler = RunProfiler(args.profile, args.tracemalloc)
+            row_index = None
+            if args.incremental:
+                targets = [column_map.get(name, name) for name in header]
+                key_indices = [targets.index(column) for column in args.key] if args.key else None
+                row_index = RowIndex(args.row_index or default_row_index_path(args.table), key_indices, reset=args.reset_index)
+            if not (args.replay or args.resume or args.fail_fast) and os.path.exists(dead_letter_path):
+                os.remove(dead_letter_path)  # Every file of this run appends to a fresh one
+
+            # Function to load one CSV file through its own engine and batch sizer; the rate
+            # limit, metrics, row index and dead-letter file are shared with the other files
+            def load_file(csv_file_path):
+                if len(args.csv) > 1:
+                    logging.info(f"Loading {csv_file_path}")
+                    print(f"Loading {csv_file_path}")
+                checkpoint_path = args.checkpoint or default_checkpoint_path(args.table, csv_file_path if len(args.csv) > 1 else None)
+                sizer = None
+                if args.adaptive:
+                    sizer = AdaptiveBatchSizer(batch_size, args.min_batch_size, args.max_batch_size, args.target_latency, args.target_bytes)
+                engine = engine_class(load_table, columns, **engine_options)
+                try:
+                    upload_csv(engine, csv_file_path, args.table, batch_size=batch_size,
+                               start_row=args.start_row, concurrency=args.concurrency, max_retries=args.max_retries,
+                               retry_delay=args.retry_delay, max_retry_delay=args.max_retry_delay,
+                               checkpoint_path=None if csv_file_path == STDIN else checkpoint_path, resume=args.resume,
+                               select=select, sizer=sizer, limiter=limiter, parse_workers=args.parse_workers,
+                               dead_letter_path=None if args.fail_fast else dead_letter_path, metrics=metrics,
+                               profiler=profiler, row_index=row_index, append_dead_letters=True)
+                finally:
+                    engine.close()
+
+            try:
+                with profiler.running():
+                    if args.replay:
+                        engine = engine_class(load_table, columns, **engine_options)
+                        try:
+                            replay_dead_letters(engine, dead_letter_path, batch_size=batch_size, max_retries=args.max_retries,
+                                                retry_delay=args.retry_delay, select=select, max_retry_delay=args.max_retry_delay,
+                                                metrics=metrics)
+                        finally:
+                            engine.close()
+                    elif args.parallel_files > 1:
+                        file_executor = ThreadPoolExecutor(max_workers=args.parallel_files)
+                        try:
+                            for future in [file_executor.submit(load_file, csv_file_path) for csv_file_path in args.csv]:
+                                future.result()
+                        finally:
+                            file_executor.shutdown(wait=True, cancel_futures=True)
+                    else:
+                        for csv_file_path in args.csv:
+                            load_file(csv_file_path)
+            finally:
+                if row_index is not None:
+                    row_index.close()
+                    logging.info(row_index.summary())
+                    print(row_index.summary())
+                metrics.finish()
+                logging.info(metrics.summary())
+                print(metrics.summary())
+                logging.info(metrics.stage_summary())
+                print(metrics.stage_summary())
+            dead_letter_count = metrics.dead_letters
+            if dead_letter_count:
+                logging.error(f"{metrics.dead_letters} rows could not be loaded, see {dead_letter_path}; "
+                              f"rerun with --replay to load them again")
+                print(f"{metrics.dead_letters} rows could not be loaded, see {dead_letter_path}; "
+                      f"rerun with --replay to load them again")
+        if staging is not None:
+            staging.swap()
+        if args.verify and not verify_upload(args, column_map, dead_letter_path):
+            return 1
+    except Exception as e:
+        logging.error(f"Failed to upload CSV: {e}")
+        print(f"Failed to upload CSV: {e}")
+        return 1
+
+    if dead_letter_count:
+        return 1  # The rest of the rows were loaded, the ones that weren't are reported above
+    logging.info("CSV upload complete.")
+    print("CSV upload complete.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,362 @@
+import re
+import os
+import csv
+import struct
+import hashlib
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from uuid import UUID
+from zoneinfo import ZoneInfo
+from checkpoint import OffsetLineReader
+from dead_letter import DeadLetterQueue, load_dead_letters
+from engines import create_connection, db_config_from_env, PostgrestHTTPError
+from input_files import open_input
+from schema import TIMESTAMP_FORMATS
+
+# Post-load verification. Every row is reduced to a 64-bit hash of its values in the text form
+# PostgreSQL outputs them in, both on the client (from the CSV values) and on the server (from
+# the table, in one aggregate query). Rows are grouped into buckets by hash, so the grouping
+# doesn't depend on row order, and each bucket is compared by its row count and the sum of its
+# row hashes. Only for the buckets that differ are the row hashes fetched, which pins down the
+# CSV rows that are missing from the table (or differ from it) and counts the table rows that
+# aren't in the files, without downloading any row data.
+
+BOOLEAN_TEXT = {'t': 'true', 'true': 'true', 'y': 'true', 'yes': 'true', 'on': 'true', '1': 'true',
+                'f': 'false', 'false': 'false', 'n': 'false', 'no': 'false', 'off': 'false', '0': 'false'}
+TIMESTAMP_TEXT = 'YYYY-MM-DD HH24:MI:SS.US'
+
+# Function to hash a row's values into a signed 64-bit integer, the same way hashed_rows_sql does
+def row_hash(values):
+    return int.from_bytes(hashlib.md5('\x1f'.join(values).encode('utf-8')).digest()[:8], 'big', signed=True)
+
+# Function to write a number the way trim_scale(value::numeric)::text does
+def decimal_text(value):
+    if not value.is_finite():
+        return str(value)
+    return format(value.normalize() + 0, 'f')  # + 0 turns -0 into 0
+
+# Converters from a CSV value to the text the server outputs for it. A value that doesn't
+# convert is compared as-is (and shows up as a difference).
+def integer_text(value):
+    return str(int(value))
+
+def numeric_text(value):
+    return decimal_text(Decimal(value.strip()))
+
+# Casting a float to numeric keeps 15 significant digits (6 for real)
+def double_text(value):
+    return decimal_text(Decimal(f"{float(value):.15g}"))
+
+def real_text(value):
+    return decimal_text(Decimal(f"{struct.unpack('f', struct.pack('f', float(value)))[0]:.6g}"))
+
+def boolean_text(value):
+    return BOOLEAN_TEXT[value.strip().lower()]
+
+def uuid_text(value):
+    return str(UUID(value.strip()))
+
+# Function to parse a timestamp the way schema.infer_type recognizes them
+def parse_timestamp(value):
+    value = value.strip()
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for format in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise ValueError(f"Not a timestamp: {value}")
+
+def date_text(value):
+    return parse_timestamp(value).strftime('%Y-%m-%d')
+
+# Writes timestamps as the server's to_char(TIMESTAMP_TEXT) does: as given for timestamp
+# columns, and in UTC for timestamptz columns, reading timestamps without an offset in the
+# server's time zone
+class TimestampText:
+    def __init__(self, time_zone=None):
+        self.time_zone = time_zone
+
+    def __call__(self, value):
+        timestamp = parse_timestamp(value)
+        if self.time_zone is None:
+            timestamp = timestamp.replace(tzinfo=None)
+        else:
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=ZoneInfo(self.time_zone))
+            timestamp = timestamp.astimezone(timezone.utc)
+        return timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+# Function to pick the SQL expression and the matching CSV value converter for a column of
+# the given type. Types without a converter are compared on their ::text output as-is.
+def column_check(column, column_type, time_zone='UTC'):
+    quoted = f'"{column}"'
+    if column_type in ('smallint', 'integer', 'bigint'):
+        return f"{quoted}::text", integer_text
+    if column_type.startswith('numeric'):
+        return f"trim_scale({quoted})::text", numeric_text
+    if column_type == 'double precision':
+        return f"trim_scale({quoted}::numeric)::text", double_text
+    if column_type == 'real':
+        return f"trim_scale({quoted}::numeric)::text", real_text
+    if column_type == 'boolean':
+        return f"{quoted}::text", boolean_text
+    if column_type == 'date':
+        return f"to_char({quoted}, 'YYYY-MM-DD')", date_text
+    if column_type.startswith('timestamp') and column_type.endswith('with time zone'):
+        return f"to_char({quoted} AT TIME ZONE 'UTC', '{TIMESTAMP_TEXT}')", TimestampText(time_zone)
+    if column_type.startswith('timestamp'):
+        return f"to_char({quoted}, '{TIMESTAMP_TEXT}')", TimestampText()
+    if column_type == 'uuid':
+        return f"{quoted}::text", uuid_text
+    return f"{quoted}::text", None
+
+# Function to build the query that hashes every row of the table and puts it in a bucket.
+# NULL and empty values both hash as '', since the engines load empty CSV values as NULL.
+# `modulus` is the SQL for the number of buckets (a query parameter or a function argument).
+def hashed_rows_sql(table_name, expressions, modulus):
+    values = ', '.join(f"coalesce({expression}, '')" for expression in expressions)
+    row_hash_sql = f"('x' || substr(md5(concat_ws(E'\\x1f', {values})), 1, 16))::bit(64)::bigint"
+    return (f"SELECT mod(mod(row_hash, {modulus}) + {modulus}, {modulus}) AS bucket, row_hash "
+            f"FROM (SELECT {row_hash_sql} AS row_hash FROM {table_name}) hashed")
+
+# Checks a table over a direct PostgreSQL connection, with no statement timeout since every
+# query scans the whole table
+class PostgresChecker:
+    def __init__(self, table_name, db_config=None):
+        self.table_name = table_name
+        self.db_config = db_config or db_config_from_env()
+        self.conn = None
+        self.hashed_sql = None
+
+    # Function to run a query and return its rows
+    def query(self, sql, params=None):
+        if self.conn is None:
+            self.conn = create_connection(self.db_config)
+            self.conn.autocommit = True
+            self.query("SET statement_timeout TO 0")
+        cur = self.conn.cursor()
+        try:
+            cur.execute(sql, params)
+            return cur.fetchall() if cur.description else None
+        finally:
+            cur.close()
+
+    # Function to get the table's column types and the server's time zone
+    def column_types(self):
+        types = dict(self.query("""
+            SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped""", (self.table_name,)))
+        return types, self.query("SELECT current_setting('TimeZone')")[0][0]
+
+    def prepare(self, expressions):
+        self.hashed_sql = hashed_rows_sql(self.table_name, expressions, '%(modulus)s')
+
+    # Function to get {bucket: (row_count, hash_sum)} for the table
+    def buckets(self, modulus):
+        rows = self.query(f"SELECT bucket, count(*), sum(row_hash) FROM ({self.hashed_sql}) hashed_rows GROUP BY bucket",
+                          {'modulus': modulus})
+        return {bucket: (count, int(checksum)) for bucket, count, checksum in rows}
+
+    # Function to get the row hashes of the table rows in some buckets
+    def row_hashes(self, modulus, buckets):
+        rows = self.query(f"SELECT row_hash FROM ({self.hashed_sql}) hashed_rows WHERE bucket = ANY(%(buckets)s)",
+                          {'modulus': modulus, 'buckets': list(buckets)})
+        return [row_hash for row_hash, in rows]
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+# Function to build the name of the verification function for a table
+def verify_function_name(table_name):
+    return f"upload_verify_{re.sub(r'[^A-Za-z0-9_]', '_', table_name)}"
+
+# Function to build the SQL that creates the verification function SupabaseChecker calls over
+# PostgREST. Run it once in the SQL editor; it runs with the caller's rights, so use a key
+# that can read every row (the service role key) for the counts to match.
+def verify_function_sql(table_name, expressions):
+    hashed_sql = hashed_rows_sql(table_name, expressions, 'modulus')
+    return (f"CREATE OR REPLACE FUNCTION {verify_function_name(table_name)}(modulus bigint, buckets bigint[] DEFAULT NULL)\n"
+            f"RETURNS TABLE (bucket bigint, row_count bigint, checksum numeric) LANGUAGE sql STABLE AS $$\n"
+            f"  SELECT bucket, count(*), sum(row_hash) FROM ({hashed_sql}) hashed_rows WHERE buckets IS NULL GROUP BY bucket\n"
+            f"  UNION ALL\n"
+            f"  SELECT bucket, 1, row_hash FROM ({hashed_sql}) hashed_rows WHERE bucket = ANY(buckets)\n"
+            f"$$;")
+
+# Checks a table through PostgREST: the column types come from its OpenAPI description, and
+# the aggregates from the verify_function_sql function, called as an RPC. PostgREST caps the
+# rows a call returns (db-max-rows, 1000 on Supabase), so the results are read in ordered
+# pages. Supabase databases run in UTC.
+class SupabaseChecker:
+    timeout = 600
+    page_size = 1000
+
+    def __init__(self, table_name, supabase_url=None, supabase_key=None):
+        import httpx
+        supabase_url = supabase_url or os.getenv('SUPABASE_URL')
+        supabase_key = supabase_key or os.getenv('SUPABASE_KEY')
+        self.table_name = table_name
+        self.function_sql = None
+        self.session = httpx.Client(base_url=f"{supabase_url.rstrip('/')}/rest/v1", timeout=self.timeout,
+                                    headers={'apikey': supabase_key, 'Authorization': f"Bearer {supabase_key}"})
+
+    def column_types(self):
+        response = self.session.get('/')
+        if response.status_code >= 400:
+            raise PostgrestHTTPError(response)
+        definition = response.json().get('definitions', {}).get(self.table_name.split('.')[-1])
+        if definition is None:
+            raise ValueError(f"PostgREST doesn't expose a table {self.table_name}")
+        return {column: spec.get('format', 'text') for column, spec in definition['properties'].items()}, 'UTC'
+
+    def prepare(self, expressions):
+        self.function_sql = verify_function_sql(self.table_name, expressions)
+
+    # Function to call the verification function and read all of its rows, page by page in
+    # `order`. The first call asks for the total count, so it is known how many pages follow
+    # even when the server returns fewer rows per page than asked for; without a count the
+    # pages are read until one comes back empty.
+    def call(self, body, order):
+        rows = []
+        total = None
+        while total is None or len(rows) < total:
+            headers = {'Prefer': 'count=exact'} if not rows else None
+            response = self.session.post(f"/rpc/{verify_function_name(self.table_name)}", json=body, headers=headers,
+                                         params={'order': order, 'limit': self.page_size, 'offset': len(rows)})
+            if response.status_code == 404:
+                raise ValueError(f"The function {verify_function_name(self.table_name)} doesn't exist; "
+                                 f"create it in the SQL editor with:\n{self.function_sql}")
+            if response.status_code >= 400:
+                raise PostgrestHTTPError(response)
+            page = response.json()
+            if not page:
+                break
+            rows += page
+            content_range = response.headers.get('Content-Range', '')
+            if total is None and content_range.rpartition('/')[2].isdigit():
+                total = int(content_range.rpartition('/')[2])
+        return rows
+
+    def buckets(self, modulus):
+        return {row['bucket']: (row['row_count'], int(row['checksum'])) for row in self.call({'modulus': modulus}, 'bucket')}
+
+    def row_hashes(self, modulus, buckets):
+        return [int(row['checksum']) for row in self.call({'modulus': modulus, 'buckets': list(buckets)}, 'bucket,checksum')]
+
+    def close(self):
+        self.session.close()
+
+# Function to hash the rows of CSV files, yielding
+# (csv_file_path, row_number, start_offset, end_offset, row_hash) for every row
+def file_row_hashes(csv_files, select, converters):
+    for csv_file_path in csv_files:
+        with open_input(csv_file_path) as f:
+            line_reader = OffsetLineReader(f)
+            reader = csv.reader(line_reader)
+            next(reader)  # Skip the header row
+            row_start = line_reader.offset
+            for row_number, row in enumerate(reader, start=1):
+                values = row if select is None else select(row)
+                texts = []
+                for value, converter in zip(values, converters):
+                    if value and converter is not None:
+                        try:
+                            value = converter(value)
+                        except (ValueError, KeyError, InvalidOperation, OverflowError):
+                            pass
+                    texts.append(value)
+                yield csv_file_path, row_number, row_start, line_reader.offset, row_hash(texts)
+                row_start = line_reader.offset
+
+# Function to write runs of row numbers as ranges, e.g. "3-7, 12"
+def row_ranges(row_numbers):
+    ranges = []
+    for row_number in sorted(row_numbers):
+        if ranges and ranges[-1][1] == row_number - 1:
+            ranges[-1][1] = row_number
+        else:
+            ranges.append([row_number, row_number])
+    return ', '.join(str(start) if start == end else f"{start}-{end}" for start, end in ranges)
+
+# Function to check that a table holds exactly the rows of CSV files. columns are the table
+# columns the files were loaded into, and select maps a CSV row onto them (see
+# copy_stream.column_selector). The CSV rows that are missing from the table or differ from it
+# are logged as row ranges and, with a dead_letter_path, added to that dead-letter file so
+# that --replay reloads just those; rows that are already in it keep their entry and error, such
+# as the load's constraint violation. Returns True when the table matches.
+def verify_table(checker, table_name, csv_files, columns, select=None, header=None, num_buckets=1024, dead_letter_path=None):
+    column_types, time_zone = checker.column_types()
+    missing_columns = [column for column in columns if column not in column_types]
+    if missing_columns:
+        raise ValueError(f"Columns {', '.join(missing_columns)} are not in table {table_name}")
+    checks = [column_check(column, column_types[column], time_zone) for column in columns]
+    checker.prepare([expression for expression, _ in checks])
+    converters = [converter for _, converter in checks]
+
+    logging.info(f"Verifying {table_name} against {', '.join(csv_files)} in {num_buckets} buckets")
+    print(f"Verifying {table_name} against {', '.join(csv_files)} in {num_buckets} buckets")
+    counts = [0] * num_buckets
+    sums = [0] * num_buckets
+    total_rows = 0
+    for _, _, _, _, hashed in file_row_hashes(csv_files, select, converters):
+        counts[hashed % num_buckets] += 1
+        sums[hashed % num_buckets] += hashed
+        total_rows += 1
+    table_buckets = checker.buckets(num_buckets)
+    table_rows = sum(count for count, _ in table_buckets.values())
+    mismatched = {bucket for bucket in range(num_buckets) if table_buckets.get(bucket, (0, 0)) != (counts[bucket], sums[bucket])}
+    if not mismatched:
+        logging.info(f"Verified {total_rows} rows: {table_name} matches the CSV files")
+        print(f"Verified {total_rows} rows: {table_name} matches the CSV files")
+        return True
+
+    # Match the rows of the buckets that differ by hash
+    table_hashes = Counter(checker.row_hashes(num_buckets, sorted(mismatched)))
+    missing = []
+    for entry in file_row_hashes(csv_files, select, converters):
+        hashed = entry[4]
+        if hashed % num_buckets not in mismatched:
+            continue
+        if table_hashes[hashed] > 0:
+            table_hashes[hashed] -= 1
+        else:
+            missing.append(entry)
+    extra = sum(table_hashes.values())
+    logging.error(f"{table_name} has {table_rows} rows and the CSV files {total_rows}: {len(mismatched)} of {num_buckets} buckets "
+                  f"differ, {len(missing)} CSV rows are missing from the table or differ, and {extra} table rows are not in the CSV files")
+    print(f"{table_name} has {table_rows} rows and the CSV files {total_rows}: {len(mismatched)} of {num_buckets} buckets "
+          f"differ, {len(missing)} CSV rows are missing from the table or differ, and {extra} table rows are not in the CSV files")
+    for csv_file_path in csv_files:
+        row_numbers = [row_number for path, row_number, _, _, _ in missing if path == csv_file_path]
+        if row_numbers:
+            logging.error(f"Rows of {csv_file_path} missing or different in {table_name}: {row_ranges(row_numbers)}")
+            print(f"Rows of {csv_file_path} missing or different in {table_name}: {row_ranges(row_numbers)}")
+
+    if dead_letter_path and missing:
+        dead_lettered = set()
+        if os.path.exists(dead_letter_path):
+            dead_lettered = {(entry['csv_file'], entry['row']) for entry in load_dead_letters(dead_letter_path)}
+        for csv_file_path in csv_files:
+            rows = [entry for entry in missing if entry[0] == csv_file_path and (os.path.abspath(csv_file_path), entry[1]) not in dead_lettered]
+            if not rows:
+                continue
+            dead_letters = DeadLetterQueue(dead_letter_path, csv_file_path, header, append=True)
+            try:
+                # The rows are in file order, so their records are read in one forward pass, which
+                # decompresses a compressed file only once
+                with open_input(csv_file_path) as f:
+                    for _, row_number, start_offset, end_offset, _ in rows:
+                        f.seek(start_offset)
+                        record = f.read(end_offset - start_offset).decode('ISO-8859-1')
+                        dead_letters.add(row_number, start_offset, end_offset, f"Not found in {table_name} by verification", record)
+            finally:
+                dead_letters.close()
+        logging.error(f"Rerun with --replay to load the rows written to {dead_letter_path}")
+        print(f"Rerun with --replay to load the rows written to {dead_letter_path}")
+    return False